@@ -0,0 +1,127 @@
+import argparse
+import json
+import os
+from collections import Counter, defaultdict
+
+from dataset import PROCESSED_DATA_PATH, ReviewStore
+from pipeline import DEFAULT_MODEL, Pipeline, batched
+
+"""
+Per-business, per-dish opinion summaries, e.g. what people say about
+the gnocchi at one restaurant. Shards of the review corpus are
+aggregated independently and merged.
+
+    python aggregation.py build --shard 0 --num-shards 4 --output aggregate_0.json
+    python aggregation.py merge aggregate_*.json --output aggregate.json
+    python aggregation.py top aggregate.json BUSINESS_ID gnocchi -k 10
+"""
+
+class OpinionAggregate():
+    """
+    Counts of opinion phrases per (business_id, aspect), plus the number
+    of reviews behind them. Aggregates of disjoint shards merge by adding
+    counts, and queries read the counters directly.
+    """
+    def __init__(self):
+        super().__init__()
+        self.phrase_counts = defaultdict(Counter)
+        self.review_counts = Counter()
+
+    def add(self, business_id, aspect_opinions):
+        for aspect, opinions in aspect_opinions.items():
+            if not opinions:
+                continue
+            key = (business_id, aspect)
+            self.phrase_counts[key].update(opinion.lower() for opinion in opinions)
+            self.review_counts[key] += 1
+
+    def merge(self, other):
+        for key, counts in other.phrase_counts.items():
+            self.phrase_counts[key].update(counts)
+        self.review_counts.update(other.review_counts)
+        return self
+
+    def top_k(self, business_id, aspect, k=10):
+        "Most frequent (phrase, count) pairs for an aspect of a business"
+        return self.phrase_counts.get((business_id, aspect), Counter()).most_common(k)
+
+    def top_aspects(self, business_id, k=10):
+        "Aspects of a business with the most reviews expressing an opinion on them"
+        aspects = Counter({aspect: count for (business, aspect), count in self.review_counts.items() if business == business_id})
+        return aspects.most_common(k)
+
+    def save(self, path):
+        with open(path, 'w') as aggregate_file:
+            for (business_id, aspect), counts in self.phrase_counts.items():
+                aggregate_file.write(json.dumps({
+                    "business_id": business_id,
+                    "aspect": aspect,
+                    "reviews": self.review_counts[(business_id, aspect)],
+                    "phrases": counts,
+                }) + "\n")
+
+    @classmethod
+    def load(cls, path):
+        aggregate = cls()
+        with open(path) as aggregate_file:
+            for line in aggregate_file:
+                entry = json.loads(line)
+                key = (entry["business_id"], entry["aspect"])
+                aggregate.phrase_counts[key].update(entry["phrases"])
+                aggregate.review_counts[key] += entry["reviews"]
+        return aggregate
+
+def aggregate_reviews(pipeline, reviews, aggregate=None, batch_size=10000, **extract_kwargs):
+    "Add the opinions of review records (dicts with business_id and text) to an aggregate"
+    aggregate = aggregate if aggregate is not None else OpinionAggregate()
+    for batch in batched(reviews, batch_size):
+        descriptions = pipeline.iter_descriptions([review['text'] for review in batch], batch_size=batch_size, **extract_kwargs)
+        for i, aspect_opinions in descriptions:
+            aggregate.add(batch[i]['business_id'], aspect_opinions)
+    return aggregate
+
+def aggregate_shard(store, shard, num_shards, pipeline=None, **extract_kwargs):
+    "Aggregate the shard-th of num_shards equal ranges of a ReviewStore"
+    pipeline = pipeline or Pipeline()
+    start = len(store) * shard // num_shards
+    end = len(store) * (shard + 1) // num_shards
+    return aggregate_reviews(pipeline, (store.get(i) for i in range(start, end)), **extract_kwargs)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build")
+    build_parser.add_argument("--reviews", default=os.path.join(PROCESSED_DATA_PATH, "italian_restaurant_reviews.json"))
+    build_parser.add_argument("--model", default=DEFAULT_MODEL)
+    build_parser.add_argument("--shard", type=int, default=0)
+    build_parser.add_argument("--num-shards", type=int, default=1)
+    build_parser.add_argument("--output", required=True)
+
+    merge_parser = subparsers.add_parser("merge")
+    merge_parser.add_argument("aggregates", nargs="+")
+    merge_parser.add_argument("--output", required=True)
+
+    top_parser = subparsers.add_parser("top")
+    top_parser.add_argument("aggregate")
+    top_parser.add_argument("business_id")
+    top_parser.add_argument("aspect", nargs="?")
+    top_parser.add_argument("-k", type=int, default=10)
+
+    args = parser.parse_args()
+    if args.command == "build":
+        store = ReviewStore(args.reviews)
+        aggregate_shard(store, args.shard, args.num_shards, Pipeline(model=args.model)).save(args.output)
+    elif args.command == "merge":
+        merged = OpinionAggregate()
+        for path in args.aggregates:
+            merged.merge(OpinionAggregate.load(path))
+        merged.save(args.output)
+    elif args.command == "top":
+        aggregate = OpinionAggregate.load(args.aggregate)
+        if args.aspect:
+            for phrase, count in aggregate.top_k(args.business_id, args.aspect, args.k):
+                print(f"{count:>6} {phrase}")
+        else:
+            for aspect, count in aggregate.top_aspects(args.business_id, args.k):
+                print(f"{count:>6} {aspect}")
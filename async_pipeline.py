@@ -0,0 +1,126 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+asyncio front-end for Pipeline. Reviews are gathered into micro-batches,
+like server.MicroBatcher does, and each batch is parsed and extracted by
+Pipeline.extract_batch in a bounded thread pool, so the event loop never
+blocks on spaCy and the prefilter, ParseCache and batched matcher are
+the same as on the sync path.
+
+    async with AsyncPipeline(Pipeline()) as pipeline:
+        aspect_opinions = await pipeline.aextract(text)
+        async for index, aspect_opinions in pipeline.aiter_descriptions(stream):
+            ...
+"""
+
+async def _aiter(reviews):
+    if hasattr(reviews, "__aiter__"):
+        async for review in reviews:
+            yield review
+    else:
+        for review in reviews:
+            yield review
+
+class AsyncPipeline():
+    def __init__(self, pipeline, max_workers=4, max_in_flight=64, max_batch=32, max_wait=0.01, cache=None):
+        super().__init__()
+        self.pipeline = pipeline
+        self.max_in_flight = max_in_flight
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._slots = None
+        self._queue = None
+        self._batcher = None
+
+    def start(self):
+        """
+        Create the semaphore, queue and batching task on the running event
+        loop. Called by `async with`, otherwise once before aextract.
+        """
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.ensure_future(self._gather_batches())
+        return self
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    async def _gather_batches(self):
+        "Send a batch once it holds max_batch reviews or its first review has waited max_wait seconds"
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            # Cancelled calls are dropped before they are parsed
+            batch = [(text, future) for text, future in batch if not future.done()]
+            if batch:
+                asyncio.ensure_future(self._run_batch(batch))
+
+    async def _run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(
+                self._executor, self.pipeline.extract_batch, [text for text, _ in batch], self.cache)
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for (_, future), aspect_opinions in zip(batch, results):
+            if not future.done():
+                future.set_result(aspect_opinions)
+
+    async def aextract(self, text):
+        """
+        Extract the aspect opinions of one review. Waits for a free slot
+        once max_in_flight reviews are pending. Cancelling the call drops
+        a review that has not been sent in a batch yet.
+        """
+        if self._slots is None:
+            raise RuntimeError("AsyncPipeline is not started, use `async with` or call start()")
+        async with self._slots:
+            future = asyncio.get_running_loop().create_future()
+            await self._queue.put((text, future))
+            return await future
+
+    async def aiter_descriptions(self, reviews):
+        """
+        Yield (index, aspect_opinions) in input order for a sync or async
+        iterable of reviews. The source is not read further while
+        max_in_flight reviews are pending, and pending work is cancelled
+        when the iteration stops early.
+        """
+        pending = deque()
+        index = 0
+        try:
+            async for text in _aiter(reviews):
+                pending.append(asyncio.ensure_future(self.aextract(text)))
+                while len(pending) >= self.max_in_flight:
+                    yield index, await pending.popleft()
+                    index += 1
+            while pending:
+                yield index, await pending.popleft()
+                index += 1
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def close(self):
+        if self._batcher is not None:
+            self._batcher.cancel()
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,349 @@
+import argparse
+import json
+import os
+import socket
+import tempfile
+import time
+import uuid
+import zlib
+
+from dataset import (
+    PROCESSED_DATA_PATH,
+    json_loads,
+    newline_aligned_ranges,
+    review_id,
+)
+from pipeline import DEFAULT_MODEL, Pipeline, batched
+
+"""
+Resumable, sharded extraction over a JSON-lines review file. A job is a
+directory on a filesystem every worker can reach, which doubles as the
+work queue:
+
+    job.json             input file, shards and extraction settings
+    claims/<shard>       claimed shards, each holding its owner's token
+    done/<shard>.jsonl   finished shards, moved into place atomically
+
+Workers on any number of machines claim unfinished shards until none are
+left, so a crashed run loses at most the shards it was working on.
+
+    python batch_runner.py plan JOB_DIR --reviews PATH --num-shards 64 [--by hash]
+    python batch_runner.py work JOB_DIR      (on every machine, as often as wanted)
+    python batch_runner.py status JOB_DIR
+    python batch_runner.py merge JOB_DIR --output results.jsonl
+"""
+
+class BatchJob():
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.claims_path = os.path.join(path, "claims")
+        self.done_path = os.path.join(path, "done")
+        with open(os.path.join(path, "job.json")) as job_file:
+            self.spec = json.load(job_file)
+
+    @classmethod
+    def plan(cls, path, reviews, num_shards, by="lines", model=DEFAULT_MODEL, batch_size=1000, n_jobs=1):
+        """
+        Create a job. by="lines" splits the file into newline-aligned byte
+        ranges, by="hash" assigns each review to crc32(review_id) % num_shards,
+        which keeps a review in the same shard when the file is rewritten,
+        but every shard then reads the whole file, see iter_reviews.
+        Planning an existing job again only works with the same settings,
+        since its done/ shards belong to that plan.
+        """
+        if by == "lines":
+            shards = [list(shard_range) for shard_range in newline_aligned_ranges(reviews, num_shards)]
+        elif by == "hash":
+            shards = list(range(num_shards))
+        else:
+            raise ValueError(f"Unknown sharding {by!r}, expected 'lines' or 'hash'")
+
+        spec = {
+            "reviews": os.path.abspath(reviews),
+            "by": by,
+            "num_shards": num_shards,
+            "shards": shards,
+            "model": model,
+            "batch_size": batch_size,
+            "n_jobs": n_jobs,
+        }
+        spec_path = os.path.join(path, "job.json")
+        if os.path.exists(spec_path):
+            with open(spec_path) as job_file:
+                if json.load(job_file) != spec:
+                    raise ValueError(f"{path} already holds a job with other settings, plan into a new directory")
+            return cls(path)
+
+        os.makedirs(os.path.join(path, "claims"), exist_ok=True)
+        os.makedirs(os.path.join(path, "done"), exist_ok=True)
+        _write_atomic(spec_path, json.dumps(spec, indent=2))
+        return cls(path)
+
+    @property
+    def shard_ids(self):
+        return list(range(len(self.spec["shards"])))
+
+    def _claim_path(self, shard):
+        return os.path.join(self.claims_path, f"{shard:05d}")
+
+    def _done_path(self, shard):
+        return os.path.join(self.done_path, f"{shard:05d}.jsonl")
+
+    def is_done(self, shard):
+        return os.path.exists(self._done_path(shard))
+
+    def claim(self, shard, stale_seconds=None):
+        """
+        Try to take a shard, returning the token that proves ownership of
+        the claim, or None. A claim older than stale_seconds is treated as
+        left over by a dead worker and taken over.
+        """
+        if self.is_done(shard):
+            return None
+        claim_path = self._claim_path(shard)
+        if stale_seconds is not None:
+            # Another worker may replace the stale claim with a fresh one
+            # between our age check and our rename, so the age is checked
+            # again on the file we actually moved, and a fresh claim is put back
+            try:
+                looks_stale = time.time() - os.path.getmtime(claim_path) > stale_seconds
+            except FileNotFoundError:
+                looks_stale = False
+            moved = _move_aside(claim_path) if looks_stale else None
+            if moved is not None:
+                if time.time() - os.path.getmtime(moved) <= stale_seconds:
+                    _put_back(moved, claim_path)
+                    return None
+                os.remove(moved)
+
+        token = uuid.uuid4().hex
+        tmp_path = f"{claim_path}.tmp-{token}"
+        with open(tmp_path, 'w') as claim_file:
+            json.dump({"token": token, "host": socket.gethostname(), "pid": os.getpid(), "time": time.time()}, claim_file)
+        # link() fails if the claim exists, and the claim is never seen half written
+        try:
+            os.link(tmp_path, claim_path)
+        except FileExistsError:
+            return None
+        finally:
+            os.remove(tmp_path)
+        # The shard may have finished between the check above and the claim
+        if self.is_done(shard):
+            self.release(shard, token)
+            return None
+        return token
+
+    def owns(self, shard, token):
+        try:
+            with open(self._claim_path(shard)) as claim_file:
+                return json.load(claim_file).get("token") == token
+        except (OSError, ValueError):
+            return False
+
+    def release(self, shard, token):
+        "Remove the claim if it is still the one token was given for"
+        claim_path = self._claim_path(shard)
+        moved = _move_aside(claim_path)
+        if moved is None:
+            return
+        try:
+            with open(moved) as claim_file:
+                ours = json.load(claim_file).get("token") == token
+        except ValueError:
+            ours = False
+        if ours:
+            os.remove(moved)
+        else:
+            _put_back(moved, claim_path)
+
+    def heartbeat(self, shard, token, retries=5, retry_seconds=0.2):
+        """
+        Refresh the claim so other workers don't consider it stale. False
+        if the claim was taken over, in which case the shard should be left
+        to its new owner. A missing claim may only be moved aside for a
+        moment by a worker checking its age, so it is looked for again
+        retries times before giving up.
+        """
+        claim_path = self._claim_path(shard)
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(retry_seconds)
+            try:
+                with open(claim_path) as claim_file:
+                    if json.load(claim_file).get("token") != token:
+                        return False
+                os.utime(claim_path)
+            except FileNotFoundError:
+                continue
+            return True
+        return False
+
+    def iter_reviews(self, shard):
+        """
+        Review dicts of a shard, in file order. With by="hash" each shard
+        reads the whole review file, so a job reads it num_shards times.
+        """
+        shard_spec = self.spec["shards"][shard]
+        with open(self.spec["reviews"], 'rb') as review_file:
+            if self.spec["by"] == "lines":
+                start, end = shard_spec
+                review_file.seek(start)
+                position = start
+                for line in review_file:
+                    if position >= end:
+                        break
+                    position += len(line)
+                    if line.strip():
+                        yield json_loads(line)
+            else:
+                for line in review_file:
+                    if line.strip() and zlib.crc32(review_id(line).encode("utf-8")) % self.spec["num_shards"] == shard:
+                        yield json_loads(line)
+
+    def run_shard(self, shard, pipeline, token):
+        """
+        Extract a claimed shard and checkpoint its results in one atomic
+        rename. Returns False, without results, if the claim was taken over.
+        """
+        tmp_path = _temp_path(self._done_path(shard))
+        try:
+            with open(tmp_path, 'w') as results_file:
+                for batch in batched(self.iter_reviews(shard), self.spec["batch_size"]):
+                    descriptions = pipeline.iter_descriptions(
+                        [review["text"] for review in batch], batch_size=len(batch), n_jobs=self.spec["n_jobs"])
+                    for i, aspect_opinions in descriptions:
+                        results_file.write(json.dumps({
+                            "review_id": batch[i]["review_id"],
+                            "business_id": batch[i]["business_id"],
+                            "aspect_opinions": aspect_opinions,
+                        }) + "\n")
+                    if not self.heartbeat(shard, token):
+                        return False
+                results_file.flush()
+                os.fsync(results_file.fileno())
+            os.replace(tmp_path, self._done_path(shard))
+            return True
+        finally:
+            # Left behind if the claim was lost or extraction raised
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def work(self, pipeline=None, stale_seconds=None):
+        """
+        Claim and run unfinished shards until there are none left to claim.
+        Returns the shards this worker finished.
+        """
+        pipeline = pipeline or Pipeline(model=self.spec["model"])
+        finished = []
+        for shard in self.shard_ids:
+            token = self.claim(shard, stale_seconds)
+            if token is None:
+                continue
+            try:
+                done = self.run_shard(shard, pipeline, token)
+            finally:
+                self.release(shard, token)
+            if done:
+                finished.append(shard)
+                print(f"Finished shard {shard} of {len(self.shard_ids)}")
+            else:
+                print(f"Shard {shard} was taken over by another worker")
+        return finished
+
+    def status(self):
+        done = [shard for shard in self.shard_ids if self.is_done(shard)]
+        claimed = [shard for shard in self.shard_ids if not self.is_done(shard) and os.path.exists(self._claim_path(shard))]
+        return {"shards": len(self.shard_ids), "done": len(done), "claimed": claimed}
+
+    def merge(self, output):
+        "Concatenate the shard results in shard order, once every shard is done"
+        missing = [shard for shard in self.shard_ids if not self.is_done(shard)]
+        if missing:
+            raise RuntimeError(f"{len(missing)} shards are not done yet, e.g. {missing[:5]}")
+        tmp_path = _temp_path(output)
+        try:
+            with open(tmp_path, 'wb') as output_file:
+                for shard in self.shard_ids:
+                    with open(self._done_path(shard), 'rb') as shard_file:
+                        for chunk in iter(lambda: shard_file.read(2 ** 20), b""):
+                            output_file.write(chunk)
+            os.replace(tmp_path, output)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+def _move_aside(path):
+    "Rename path to a unique name and return it, or None if path doesn't exist"
+    moved = f"{path}.moved-{uuid.uuid4().hex}"
+    try:
+        os.rename(path, moved)
+    except FileNotFoundError:
+        return None
+    return moved
+
+def _put_back(moved, path):
+    "Undo _move_aside, unless a new file was created at path in the meantime"
+    try:
+        os.link(moved, path)
+    except FileExistsError:
+        pass
+    os.remove(moved)
+
+def _temp_path(path):
+    """
+    Create a uniquely named empty file next to path, so concurrent writers
+    never share one and os.replace stays on the same filesystem. mkstemp
+    creates it readable by its owner only, workers running as other users
+    must be able to read it too.
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path) or ".")
+    os.close(fd)
+    os.chmod(tmp_path, 0o644)
+    return tmp_path
+
+def _write_atomic(path, text):
+    tmp_path = _temp_path(path)
+    try:
+        with open(tmp_path, 'w') as tmp_file:
+            tmp_file.write(text)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    plan_parser = subparsers.add_parser("plan")
+    plan_parser.add_argument("job")
+    plan_parser.add_argument("--reviews", default=os.path.join(PROCESSED_DATA_PATH, "italian_restaurant_reviews.json"))
+    plan_parser.add_argument("--num-shards", type=int, default=64)
+    plan_parser.add_argument("--by", choices=["lines", "hash"], default="lines")
+    plan_parser.add_argument("--model", default=DEFAULT_MODEL)
+    plan_parser.add_argument("--batch-size", type=int, default=1000)
+    plan_parser.add_argument("--n-jobs", type=int, default=1)
+
+    work_parser = subparsers.add_parser("work")
+    work_parser.add_argument("job")
+    work_parser.add_argument("--stale-seconds", type=float,
+        help="Take over claims that haven't been refreshed for this long")
+
+    status_parser = subparsers.add_parser("status")
+    status_parser.add_argument("job")
+
+    merge_parser = subparsers.add_parser("merge")
+    merge_parser.add_argument("job")
+    merge_parser.add_argument("--output", required=True)
+
+    args = parser.parse_args()
+    if args.command == "plan":
+        job = BatchJob.plan(args.job, args.reviews, args.num_shards, args.by, args.model, args.batch_size, args.n_jobs)
+        print("Planned", len(job.shard_ids), "shards in", args.job)
+    elif args.command == "work":
+        BatchJob(args.job).work(stale_seconds=args.stale_seconds)
+    elif args.command == "status":
+        print(BatchJob(args.job).status())
+    elif args.command == "merge":
+        BatchJob(args.job).merge(args.output)
@@ -0,0 +1,190 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import re
+import time
+
+import numpy as np
+import spacy
+
+from data import get_annotated_examples_all
+from dataset import (
+    YELP_DATA_PATH,
+    load_italian_restaurants_data,
+    scan_reviews_by_business,
+)
+from pipeline import DEFAULT_MODEL, Pipeline, model_load_stats, peak_memory_mb, preprocess_parallel
+
+"""
+Benchmarks for the data preparation and extraction steps.
+
+    python benchmark.py scan [--reviews PATH] [--n-jobs 1 2 4 8]
+    python benchmark.py pipeline [--model NAME] [--sizes 1000 10000] [--output bench.json]
+"""
+
+def _scan_reviews_json_loop(path, business_ids):
+    "The original Dataset.italian_restaurant_reviews loop, kept as the baseline"
+    matched = []
+    with open(path, 'r') as academic_data_file:
+        for line in academic_data_file:
+            data_dict = json.loads(line.strip())
+            if data_dict['business_id'] in business_ids:
+                matched.append(line)
+    return matched
+
+def _count_lines(path):
+    with open(path, 'rb') as data_file:
+        return sum(1 for _ in data_file)
+
+def benchmark_review_scan(path, business_ids, n_jobs_options=(1, 2, 4, 8)):
+    """
+    Compare lines per second of the single-core json.loads loop with the
+    sharded scanner at each worker count, checking the outputs are identical
+    """
+    num_lines = _count_lines(path)
+    results = []
+
+    start = time.perf_counter()
+    baseline = _scan_reviews_json_loop(path, business_ids)
+    elapsed = time.perf_counter() - start
+    results.append({"method": "json_loop", "n_jobs": 1, "seconds": elapsed, "lines_per_second": num_lines / elapsed})
+
+    for n_jobs in n_jobs_options:
+        start = time.perf_counter()
+        lines = scan_reviews_by_business(path, business_ids, n_jobs=n_jobs)
+        elapsed = time.perf_counter() - start
+        assert lines == baseline, f"Sharded scan with n_jobs={n_jobs} differs from the baseline"
+        results.append({"method": "sharded", "n_jobs": n_jobs, "seconds": elapsed, "lines_per_second": num_lines / elapsed})
+
+    for result in results:
+        print(f"{result['method']:<10} n_jobs={result['n_jobs']:<3} {result['seconds']:8.2f}s {result['lines_per_second']:12.0f} lines/s")
+    return results
+
+def synthetic_corpus(texts, size, seed=0):
+    "Reviews of 1 to 8 sentences sampled from texts, to scale the corpus while keeping its vocabulary"
+    rng = random.Random(seed)
+    sentences = [sentence for text in texts for sentence in re.split(r"(?<=[.!?])\s+", text.strip()) if sentence]
+    return [" ".join(rng.choice(sentences) for _ in range(rng.randint(1, 8))) for _ in range(size)]
+
+def _percentiles(values):
+    if not values:
+        return {"p50": 0., "p99": 0.}
+    return {"p50": float(np.percentile(values, 50)), "p99": float(np.percentile(values, 99))}
+
+def benchmark_corpus(pipeline, name, texts, batch_size=20):
+    """
+    Stream texts through nlp.pipe, the parse rules and the matcher pass
+    in one process, timing each stage per review. A review's latency is
+    the wait for its Doc from nlp.pipe plus its rule and matcher time.
+    """
+    nlp = pipeline.nlp
+    stage_seconds = {"nlp_pipe": 0., "parse_review": 0., "matcher": 0.}
+    latencies = []
+    num_tokens = 0
+
+    start = time.perf_counter()
+    last = start
+    for doc in nlp.pipe(texts, batch_size=batch_size):
+        parsed = time.perf_counter()
+        aspect_opinions = pipeline._parse_tokens(doc)
+        extracted = time.perf_counter()
+        pipeline._merge_matches(doc, aspect_opinions)
+        matched = time.perf_counter()
+
+        stage_seconds["nlp_pipe"] += parsed - last
+        stage_seconds["parse_review"] += extracted - parsed
+        stage_seconds["matcher"] += matched - extracted
+        latencies.append(matched - last)
+        num_tokens += len(doc)
+        last = matched
+    elapsed = max(time.perf_counter() - start, 1e-9)
+
+    result = {
+        "corpus": name,
+        "num_reviews": len(texts),
+        "num_tokens": num_tokens,
+        "seconds": elapsed,
+        "reviews_per_second": len(texts) / elapsed,
+        "tokens_per_second": num_tokens / elapsed,
+        "latency_seconds": _percentiles(latencies),
+        "stage_seconds": stage_seconds,
+        "peak_rss_mb": peak_memory_mb(),
+    }
+    print(f"{name:<16} {len(texts):>7} reviews {result['reviews_per_second']:9.1f} reviews/s "
+        f"{result['tokens_per_second']:10.0f} tokens/s p50 {result['latency_seconds']['p50'] * 1000:7.2f}ms "
+        f"p99 {result['latency_seconds']['p99'] * 1000:7.2f}ms")
+    return result
+
+def benchmark_parallel_settings(model, texts, n_jobs_options=(1, 4, 10), batch_size_options=(20, 100), chunksize_options=(100, 1000), backends=("threading",)):
+    "Throughput of preprocess_parallel for every combination of its settings"
+    results = []
+    for backend, n_jobs, batch_size, chunksize in itertools.product(backends, n_jobs_options, batch_size_options, chunksize_options):
+        start = time.perf_counter()
+        preprocess_parallel(texts, chunksize=chunksize, n_jobs=n_jobs, backend=backend, model=model, batch_size=batch_size)
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        results.append({
+            "backend": backend,
+            "n_jobs": n_jobs,
+            "batch_size": batch_size,
+            "chunksize": chunksize,
+            "seconds": elapsed,
+            "reviews_per_second": len(texts) / elapsed,
+        })
+        print(f"{backend:<10} n_jobs={n_jobs:<3} batch_size={batch_size:<4} chunksize={chunksize:<5} {len(texts) / elapsed:9.1f} reviews/s")
+    return sorted(results, key=lambda result: -result["reviews_per_second"])
+
+def benchmark_pipeline(model=DEFAULT_MODEL, sizes=(1000, 10000), settings_size=1000, backends=("threading",), seed=0):
+    pipeline = Pipeline(model=model)
+    # Load the model first so it is timed on its own
+    pipeline.nlp
+    annotated = list(dict.fromkeys(get_annotated_examples_all()))
+
+    corpora = [benchmark_corpus(pipeline, "annotated", annotated)]
+    for size in sizes:
+        corpora.append(benchmark_corpus(pipeline, f"synthetic_{size}", synthetic_corpus(annotated, size, seed)))
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "spacy": spacy.__version__,
+            "model": model,
+            "model_version": pipeline.nlp.meta.get("version"),
+            "cpu_count": os.cpu_count(),
+        },
+        "model_load": model_load_stats[model],
+        "corpora": corpora,
+        "parallel_settings": benchmark_parallel_settings(
+            model, synthetic_corpus(annotated, settings_size, seed), backends=backends),
+    }
+
+def _write_results(results, output):
+    if output:
+        with open(output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scan_parser = subparsers.add_parser("scan")
+    scan_parser.add_argument("--reviews", default=os.path.join(YELP_DATA_PATH, "yelp_academic_dataset_review.json"))
+    scan_parser.add_argument("--n-jobs", type=int, nargs="+", default=[1, 2, 4, 8])
+    scan_parser.add_argument("--output")
+
+    pipeline_parser = subparsers.add_parser("pipeline")
+    pipeline_parser.add_argument("--model", default=DEFAULT_MODEL)
+    pipeline_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    pipeline_parser.add_argument("--settings-size", type=int, default=1000)
+    pipeline_parser.add_argument("--backends", nargs="+", default=["threading"])
+    pipeline_parser.add_argument("--seed", type=int, default=0)
+    pipeline_parser.add_argument("--output", default="bench_output.json")
+
+    args = parser.parse_args()
+    if args.command == "scan":
+        business_ids = {json.loads(line)["business_id"] for line in load_italian_restaurants_data()}
+        _write_results(benchmark_review_scan(args.reviews, business_ids, args.n_jobs), args.output)
+    elif args.command == "pipeline":
+        _write_results(benchmark_pipeline(args.model, args.sizes, args.settings_size, args.backends, args.seed), args.output)
@@ -0,0 +1,125 @@
+import time
+
+"""
+Optional coreference resolution for the anaphora rules. Only reviews
+where a pronoun follows an aspect mention are resolved, in batches, and
+the clusters are kept in the ParseCache next to the parses.
+
+The clusters are resolved on the Pipeline's own Docs. neuralcoref finds
+its mentions from fine-grained tags and entities, so a Pipeline with a
+CorefStage loads its model with NER (see pipeline.keep_ner), and compact
+parses keep both.
+
+    pipeline = Pipeline(coref=CorefStage(NeuralCorefResolver()))
+    pipeline.extract_descriptions(texts, cache=ParseCache())
+
+A resolver is any object with a `name`, identifying it and its settings
+in the cache, and a resolve(docs) method that returns, for every Doc,
+its clusters as lists of [start, end] token spans.
+"""
+
+class NeuralCorefResolver():
+    "Clusters from neuralcoref, which is imported and loaded on first use"
+    def __init__(self, greedyness=0.5, max_dist=50, batch_size=32):
+        super().__init__()
+        self.greedyness = greedyness
+        self.max_dist = max_dist
+        self.batch_size = batch_size
+        self._coref = None
+
+    @property
+    def name(self):
+        return f"neuralcoref-greedyness{self.greedyness}-max_dist{self.max_dist}"
+
+    def __getstate__(self):
+        # Each process loads its own neuralcoref model
+        state = self.__dict__.copy()
+        state["_coref"] = None
+        return state
+
+    def _component(self, vocab):
+        if self._coref is None:
+            import neuralcoref
+            self._coref = neuralcoref.NeuralCoref(vocab, greedyness=self.greedyness, max_dist=self.max_dist)
+        return self._coref
+
+    def resolve(self, docs):
+        if not docs:
+            return []
+        coref = self._component(docs[0].vocab)
+        return [[[[mention.start, mention.end] for mention in cluster.mentions] for cluster in doc._.coref_clusters or []]
+            for doc in coref.pipe(docs, batch_size=self.batch_size)]
+
+class CorefStage():
+    """
+    Decides which Docs are worth resolving and caches the results. A Doc
+    is resolved if an anaphora word comes at most max_distance tokens
+    after an aspect mention, everything else keeps the rank heuristic
+    of Pipeline._parse_anaphora.
+    """
+    def __init__(self, resolver=None, max_distance=50):
+        super().__init__()
+        self.resolver = resolver if resolver is not None else NeuralCorefResolver()
+        self.max_distance = max_distance
+
+        self.docs_resolved = 0
+        self.docs_skipped = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.resolve_seconds = 0.
+
+    def wants(self, doc, lexicon):
+        candidates, aspect_labels, anaphora_flags = lexicon.flag_tokens(doc)
+        last_mention = None
+        for i, aspect_label, is_anaphora in zip(candidates, aspect_labels, anaphora_flags):
+            if aspect_label is not None:
+                last_mention = i
+            elif is_anaphora and last_mention is not None and i - last_mention <= self.max_distance:
+                return True
+        return False
+
+    def resolve(self, texts, docs, lexicon, cache=None, namespace=""):
+        "Clusters of each Doc, None for the Docs that are not resolved"
+        clusters = [None] * len(docs)
+        wanted = [i for i, doc in enumerate(docs) if self.wants(doc, lexicon)]
+        self.docs_skipped += len(docs) - len(wanted)
+        if not wanted:
+            return clusters
+
+        namespace = f"{namespace}-coref-{self.resolver.name}"
+        # Kept out of the parse cache's own hit and miss counts
+        cached = cache.get_many(namespace, [texts[i] for i in wanted], count=False) if cache is not None else {}
+        missing = []
+        for i in wanted:
+            if texts[i] in cached:
+                clusters[i] = cached[texts[i]]
+                self.cache_hits += 1
+            else:
+                missing.append(i)
+        self.cache_misses += len(missing)
+
+        if missing:
+            start = time.perf_counter()
+            for i, doc_clusters in zip(missing, self.resolver.resolve([docs[i] for i in missing])):
+                clusters[i] = doc_clusters
+            self.resolve_seconds += time.perf_counter() - start
+            if cache is not None:
+                cache.put_many(namespace, [(texts[i], clusters[i]) for i in missing])
+        self.docs_resolved += len(wanted)
+        return clusters
+
+    def reset(self):
+        self.docs_resolved = 0
+        self.docs_skipped = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.resolve_seconds = 0.
+
+    def stats(self):
+        return {
+            "docs_resolved": self.docs_resolved,
+            "docs_skipped": self.docs_skipped,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "resolve_seconds": self.resolve_seconds,
+        }
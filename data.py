@@ -1,5 +1,8 @@
+import os
+
 import pandas as pd
-from nltk.tokenize import word_tokenize
+
+from dataset import PROCESSED_DATA_PATH, ReviewStore
 
 def get_annotated_examples_with_opinions():
     df = pd.read_csv('processed_data/annotated_lexicon_based_reviews.csv', dtype={
@@ -14,12 +17,26 @@ def get_annotated_examples_all():
     reviews = df['text'].tolist()
     return reviews
 
+_italian_review_store = None
+
+def italian_review_store():
+    "Opened once per process, so lookups don't reload the review id index"
+    global _italian_review_store
+    if _italian_review_store is None:
+        _italian_review_store = ReviewStore(os.path.join(PROCESSED_DATA_PATH, 'italian_restaurant_reviews.json'))
+    return _italian_review_store
+
+def reviews_for_business(business_id, store=None):
+    store = store or italian_review_store()
+    return [review['text'] for review in store.by_business(business_id)]
+
+def reviews_by_id(review_ids, store=None):
+    store = store or italian_review_store()
+    return [store.by_id(review_id)['text'] for review_id in review_ids]
+
 def all_lexicon_based_reviews():
     df = pd.read_csv('processed_data/lexicon_based_reviews.csv')
     reviews = df['text'].tolist()
-    filtered_reviews = [review for review in reviews if len(word_tokenize(review)) < 500]
-    # rev_lens = []
-    # for review in reviews:
-    #     rev_lens.append(len(word_tokenize(review)))
-    # print(describe(rev_lens))
+    # Long reviews no longer need filtering out, parse them with
+    # pipeline.LengthBatching to split them into sentence windows
     return reviews
\ No newline at end of file
@@ -1,14 +1,233 @@
 import os
+import re
+import csv
 import json
+import mmap
+import time
+import multiprocessing
 
 import sys
 from pprint import pprint
 from tqdm.auto import tqdm
 
+import numpy as np
 import pandas as pd
 from collections import defaultdict
 
+from lexicon import DEFAULT_LEXICON
+
+try:
+    # Much faster decoding when available, same output as json.loads
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 PROCESSED_DATA_PATH = "processed_data"
+YELP_DATA_PATH = "Yelp"
+
+# Yelp ids are plain [A-Za-z0-9_-] strings, so they can be read
+# off the raw line without decoding the whole review
+BUSINESS_ID_PATTERN = re.compile(rb'"business_id"\s*:\s*"([^"\\]*)"')
+REVIEW_ID_PATTERN = re.compile(rb'"review_id"\s*:\s*"([^"\\]*)"')
+
+def _raw_field(line, pattern, name):
+    match = pattern.search(line)
+    if match:
+        return match.group(1).decode("utf-8")
+    return json_loads(line)[name]
+
+def review_business_id(line):
+    "business_id of a raw JSON review line (bytes)"
+    return _raw_field(line, BUSINESS_ID_PATTERN, "business_id")
+
+def review_id(line):
+    "review_id of a raw JSON review line (bytes)"
+    return _raw_field(line, REVIEW_ID_PATTERN, "review_id")
+
+def newline_aligned_ranges(path, num_shards):
+    "Split a file into up to num_shards (start, end) byte ranges that begin on a line"
+    size = os.path.getsize(path)
+    boundaries = [0]
+    with open(path, 'rb') as data_file:
+        for shard in range(1, num_shards):
+            position = max(size * shard // num_shards, boundaries[-1])
+            if position >= size:
+                break
+            if position == 0:
+                continue
+            # Reading from one byte early keeps a range that already starts on a line
+            data_file.seek(position - 1)
+            data_file.readline()
+            if data_file.tell() > boundaries[-1]:
+                boundaries.append(data_file.tell())
+    if boundaries[-1] != size:
+        boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+_shard_business_ids = None
+
+def _init_shard_worker(business_ids):
+    global _shard_business_ids
+    _shard_business_ids = business_ids
+
+def _scan_shard(task):
+    path, start, end = task
+    matched = []
+    position = start
+    with open(path, 'rb') as data_file:
+        data_file.seek(start)
+        for line in data_file:
+            if position >= end:
+                break
+            position += len(line)
+            if line.strip() and review_business_id(line) in _shard_business_ids:
+                matched.append(line.decode("utf-8"))
+    return matched
+
+def scan_reviews_by_business(path, business_ids, n_jobs=None, num_shards=None):
+    """
+    Return the raw lines of the review dump at path whose business_id is
+    in business_ids, in file order. The file is split into newline-aligned
+    byte ranges that are scanned in a process pool.
+    """
+    n_jobs = n_jobs or os.cpu_count()
+    shards = newline_aligned_ranges(path, num_shards or n_jobs * 4)
+    tasks = [(path, start, end) for start, end in shards]
+    business_ids = set(business_ids)
+
+    if n_jobs == 1:
+        _init_shard_worker(business_ids)
+        return [line for task in tqdm(tasks) for line in _scan_shard(task)]
+
+    lines = []
+    with multiprocessing.Pool(n_jobs, initializer=_init_shard_worker, initargs=(business_ids,)) as pool:
+        for shard_lines in tqdm(pool.imap(_scan_shard, tasks), total=len(tasks)):
+            lines.extend(shard_lines)
+    return lines
+
+class ReviewStore(object):
+    """
+    Random access to a JSON-lines review file such as
+    italian_restaurant_reviews.json. An index built once next to the file
+    keeps the byte offset of every review, the sorted review_ids for
+    binary search lookups and, for each business, a contiguous range of a
+    by-business ordering of the reviews. The arrays are memory-mapped, so
+    opening a store doesn't decode the ids, and reviews are only decoded
+    when asked for.
+    """
+    INDEX_VERSION = 2
+
+    def __init__(self, path, index_path=None):
+        super().__init__()
+        self.path = path
+        self.index_path = index_path or path + ".index"
+        if not self._index_is_fresh():
+            self.build()
+
+        with open(os.path.join(self.index_path, "meta.json")) as meta_file:
+            meta = json.load(meta_file)
+        self.offsets = np.load(os.path.join(self.index_path, "offsets.npy"), mmap_mode="r")
+        self.by_business_order = np.load(os.path.join(self.index_path, "by_business.npy"), mmap_mode="r")
+        self.sorted_ids = np.load(os.path.join(self.index_path, "sorted_ids.npy"), mmap_mode="r")
+        self.sorted_id_order = np.load(os.path.join(self.index_path, "sorted_id_order.npy"), mmap_mode="r")
+        self.businesses = meta["businesses"]
+
+        self._file = open(path, 'rb')
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if len(self) else b""
+
+    def _source_signature(self):
+        stat = os.stat(self.path)
+        return [stat.st_size, stat.st_mtime]
+
+    def _index_is_fresh(self):
+        meta_path = os.path.join(self.index_path, "meta.json")
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+        return meta.get("source") == self._source_signature() and meta.get("version") == self.INDEX_VERSION
+
+    def build(self):
+        offsets = []
+        ends = []
+        review_ids = []
+        business_reviews = defaultdict(list)
+
+        position = 0
+        with open(self.path, 'rb') as review_file:
+            for line in tqdm(review_file, unit="lines"):
+                if line.strip():
+                    business_reviews[review_business_id(line)].append(len(offsets))
+                    review_ids.append(review_id(line))
+                    offsets.append(position)
+                    ends.append(position + len(line))
+                position += len(line)
+
+        by_business = []
+        businesses = {}
+        for business_id, reviews in business_reviews.items():
+            businesses[business_id] = [len(by_business), len(by_business) + len(reviews)]
+            by_business.extend(reviews)
+
+        os.makedirs(self.index_path, exist_ok=True)
+        np.save(os.path.join(self.index_path, "offsets.npy"), np.asarray([offsets, ends], dtype="int64").reshape(2, -1).T)
+        np.save(os.path.join(self.index_path, "by_business.npy"), np.asarray(by_business, dtype="int64"))
+        ids = np.asarray([review_id.encode("utf-8") for review_id in review_ids], dtype=f"S{max(map(len, review_ids), default=1)}")
+        order = np.argsort(ids, kind="stable")
+        np.save(os.path.join(self.index_path, "sorted_ids.npy"), ids[order])
+        np.save(os.path.join(self.index_path, "sorted_id_order.npy"), order.astype("int64"))
+        with open(os.path.join(self.index_path, "meta.json"), 'w') as meta_file:
+            json.dump({
+                "version": self.INDEX_VERSION,
+                "source": self._source_signature(),
+                "businesses": businesses,
+            }, meta_file)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def raw(self, i):
+        "Undecoded JSON line of the i-th review, without its newline"
+        start, end = self.offsets[i]
+        return self._data[start:end].rstrip()
+
+    def get(self, i):
+        return json_loads(self.raw(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.get(i)
+
+    def index_of(self, review_id):
+        key = review_id.encode("utf-8")
+        position = int(np.searchsorted(self.sorted_ids, key))
+        if position == len(self.sorted_ids) or self.sorted_ids[position] != key:
+            raise KeyError(review_id)
+        return int(self.sorted_id_order[position])
+
+    def by_id(self, review_id):
+        return self.get(self.index_of(review_id))
+
+    def review_count(self, business_id):
+        start, end = self.businesses.get(business_id, (0, 0))
+        return end - start
+
+    def by_business(self, business_id):
+        start, end = self.businesses.get(business_id, (0, 0))
+        for i in self.by_business_order[start:end]:
+            yield self.get(i)
+
+    def close(self):
+        if len(self):
+            self._data.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 def load_processed_data(path):
     with open(os.path.join(
@@ -36,12 +255,37 @@ def load_restaurants_data():
 def load_italian_restaurants_data():
     return load_processed_data("italian_restaurant_businesses.json")
 
+class _Throughput(object):
+    "Prints the number of lines, MB and rate of a streaming pass when it ends"
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+        self.lines = 0
+        self.bytes = 0
+
+    def update(self, line):
+        self.lines += 1
+        self.bytes += len(line)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        print(f"{self.name}: {self.lines} lines, {self.bytes / 2 ** 20:.1f} MB in {elapsed:.1f}s "
+            f"({self.lines / elapsed:.0f} lines/s, {self.bytes / 2 ** 20 / elapsed:.1f} MB/s)")
+
 class Dataset(object):
     def __init__(self):
         super().__init__()
 
         self.target_path = PROCESSED_DATA_PATH
 
+    def review_store(self):
+        "ReviewStore over italian_restaurant_reviews.json, indexed on first use"
+        return ReviewStore(os.path.join(self.target_path, 'italian_restaurant_reviews.json'))
+
     def _save_processed_data(self, filename, data):
         with open(os.path.join(self.target_path, filename), 'w') as processed_data_file:
             processed_data_file.writelines(data)
@@ -85,26 +329,17 @@ class Dataset(object):
 
         self._save_processed_data('restaurant_businesses.json', restaurant_businesses)
 
-    def italian_restaurant_reviews(self):
+    def italian_restaurant_reviews(self, n_jobs=None):
         italian_restaurant_info = {}
         
         for line in load_italian_restaurants_data():
             data_dict = json.loads(line)
             italian_restaurant_info[data_dict["business_id"]] = data_dict
         
-        italian_reviews = []
-
-        # Doing file open since the reviews data is huge, more memory efficient
-        with open(os.path.join(
-            'Yelp',
-            'yelp_academic_dataset_review.json'
-        ), 'r') as academic_data_file:
-            for line in tqdm(academic_data_file):
-                data_dict = json.loads(line.strip())
-                review_business = data_dict['business_id']
-
-                if review_business in italian_restaurant_info:
-                    italian_reviews.append(line)
+        italian_reviews = scan_reviews_by_business(
+            os.path.join(YELP_DATA_PATH, 'yelp_academic_dataset_review.json'),
+            italian_restaurant_info,
+            n_jobs=n_jobs)
         
         self._save_processed_data('italian_restaurant_reviews.json', italian_reviews)
 
@@ -116,34 +351,24 @@ class Dataset(object):
             data_dict["num_reviews"] = 0
             italian_restaurant_info[data_dict["business_id"]] = data_dict
 
-        for line in load_processed_data("italian_restaurant_reviews.json"):
-            data_dict = json.loads(line)
-            review_business = data_dict['business_id']
-            business = italian_restaurant_info[review_business]
-            business["num_reviews"] += 1
+        with self.review_store() as store:
+            for business_id, business in italian_restaurant_info.items():
+                business["num_reviews"] = store.review_count(business_id)
         
         
         sorted_businesses = sorted(list(italian_restaurant_info.values()), key=lambda x: -x['num_reviews'])
         sorted_businesses_lines = [json.dumps(biz) + "\n" for biz in sorted_businesses]
         self._save_processed_data('italian_restaurants_sorted_by_reviews.json', sorted_businesses_lines)
 
-    def restaurant_reviews_containing_lexicon_items(self):
-        lexicon = [
-            'pizza',
-            'gnocchi',
-            'gelato',
-            'lasagna',
-            'bruschetta',
-        ]
-
+    def restaurant_reviews_containing_lexicon_items(self, lexicon=DEFAULT_LEXICON):
         reviews = []
         reviews_dicts = []
         num_mentioned_items = defaultdict(int)
-        for line in load_processed_data("italian_restaurant_reviews.json"):
-            data_dict = json.loads(line)
-            lower_text = data_dict['text'].lower()
-            for item in lexicon:
-                if item in lower_text:
+        with self.review_store() as store:
+            for i in range(len(store)):
+                line = store.raw(i).decode("utf-8")
+                data_dict = json_loads(line)
+                for item in lexicon.mentioned_labels(data_dict['text']):
                     reviews.append(line)
                     reviews_dicts.append(data_dict)
                     num_mentioned_items[item] += 1
@@ -155,6 +380,85 @@ class Dataset(object):
         reviews_df.iloc[:100].to_csv('lexicon_based_reviews_sample.csv', columns=['review_id', 'text'], index_label='review_id')
 
 
+    def prepare_all(self, lexicon=DEFAULT_LEXICON):
+        """
+        Streaming equivalent of running prepare_category_information,
+        prepare_restaurant_businesses, prepare_italian_restaurant_business,
+        italian_restaurant_reviews, most_popular_italian_restaurants and
+        restaurant_reviews_containing_lexicon_items in turn, reading the
+        business file and the review file once each. Only the Italian
+        businesses are held in memory.
+        """
+        categoriesSet = set()
+        italian_restaurant_info = {}
+
+        business_path = os.path.join(YELP_DATA_PATH, "yelp_academic_dataset_business.json")
+        with open(business_path, 'r') as business_file, \
+                self._open_processed_data('restaurant_businesses.json') as restaurants_file, \
+                self._open_processed_data('italian_restaurant_businesses.json') as italian_file, \
+                _Throughput("businesses") as throughput:
+            for line in tqdm(business_file, unit="lines"):
+                throughput.update(line)
+                line = line.strip()
+                data_dict = json.loads(line)
+                categories_str = data_dict['categories']
+                categoriesSet.update(categories_str.split(", ") if categories_str else [])
+
+                # Kept as in prepare_restaurant_businesses, which splits on spaces
+                if categories_str and "Restaurants" in categories_str.split(" "):
+                    restaurants_file.write(line + "\n")
+                    if "Italian" in categories_str.split(", "):
+                        italian_file.write(line + "\n")
+                        data_dict["num_reviews"] = 0
+                        italian_restaurant_info[data_dict["business_id"]] = data_dict
+
+        self._save_processed_data('categories.txt', [term + '\n' for term in sorted(categoriesSet)])
+
+        num_mentioned_items = defaultdict(int)
+        review_path = os.path.join(YELP_DATA_PATH, "yelp_academic_dataset_review.json")
+        sample_path = 'lexicon_based_reviews_sample.csv'
+        with open(review_path, 'r') as review_file, \
+                self._open_processed_data('italian_restaurant_reviews.json') as italian_reviews_file, \
+                self._open_processed_data('lexicon_item_reviews.json') as lexicon_reviews_file, \
+                self._open_processed_data('lexicon_based_reviews.csv') as lexicon_csv_file, \
+                open(sample_path, 'w', newline='') as sample_csv_file, \
+                _Throughput("reviews") as throughput:
+            # Same layout as the pandas export in _prepare_dataframe_from_data
+            lexicon_csv = csv.writer(lexicon_csv_file, lineterminator="\n")
+            sample_csv = csv.writer(sample_csv_file, lineterminator="\n")
+            lexicon_csv.writerow(['review_id', 'review_id', 'text'])
+            sample_csv.writerow(['review_id', 'review_id', 'text'])
+
+            num_lexicon_rows = 0
+            for line in tqdm(review_file, unit="lines"):
+                throughput.update(line)
+                line = line.strip()
+                data_dict = json.loads(line)
+                business = italian_restaurant_info.get(data_dict['business_id'])
+                if business is None:
+                    continue
+
+                italian_reviews_file.write(line + "\n")
+                business["num_reviews"] += 1
+
+                for item in lexicon.mentioned_labels(data_dict['text']):
+                    row = [num_lexicon_rows, data_dict['review_id'], data_dict['text']]
+                    lexicon_reviews_file.write(line + "\n")
+                    lexicon_csv.writerow(row)
+                    if num_lexicon_rows < 100:
+                        sample_csv.writerow(row)
+                    num_lexicon_rows += 1
+                    num_mentioned_items[item] += 1
+        print(dict(num_mentioned_items))
+
+        sorted_businesses = sorted(italian_restaurant_info.values(), key=lambda x: -x['num_reviews'])
+        self._save_processed_data(
+            'italian_restaurants_sorted_by_reviews.json',
+            [json.dumps(biz) + "\n" for biz in sorted_businesses])
+
+    def _open_processed_data(self, filename):
+        return open(os.path.join(self.target_path, filename), 'w', newline='')
+
     def _prepare_dataframe_from_data(self, filename, data, columns):
         file_path = os.path.join(self.target_path, filename)
         df = pd.DataFrame(data)
@@ -164,4 +468,7 @@ class Dataset(object):
     
 if __name__ == "__main__":
     dataset = Dataset()
-    dataset.restaurant_reviews_containing_lexicon_items()
\ No newline at end of file
+    if sys.argv[1:] == ["all"]:
+        dataset.prepare_all()
+    else:
+        dataset.restaurant_reviews_containing_lexicon_items()
\ No newline at end of file
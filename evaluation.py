@@ -1,83 +1,26 @@
 from data import get_annotated_examples_with_opinions
 from pipeline import Pipeline
+from parse_cache import ParseCache
+from metrics import evaluate
+from lexicon import DEFAULT_LEXICON
 
 import re
 from collections import defaultdict
 
-LEXICON = [
-    'pizza',
-    'gnocchi',
-    'bruschetta',
-    'gelato',
-    'lasagna'
-]
-
-def compute_accuracy(partial, error):
-    if (partial + error) > 0:
-        return partial / (partial + error)
-    else:
-        return 0
-
-def compute_metrics(hypotheses, references):
-    
-    exact_matches = 0
-    inexact_matches = 0
-
-    exact_match_false_positives = 0
-    exact_match_false_negatives = 0
-
-    inexact_match_false_positives = 0
-    inexact_match_false_negatives = 0
-
-    # We can define exact and inexact variants of 
-    # precision and recall
-    # that allow us to capture complete and partial matches
-
-    assert len(hypotheses) == len(references), "The lengths of hypothees and references differ!"
-
-    for h, r in zip(hypotheses, references):
-        num_current_exact_matches = 0
-        num_current_inexact_matches = 0
-
-        num_current_hypotheses_items = 0
-        num_current_reference_items = 0
-        for item in LEXICON:
-            hypotheses_opinions = set(h[item])
-            reference_opinions = set(r[item])
-
-            num_current_hypotheses_items += len(hypotheses_opinions)
-            num_current_reference_items += len(reference_opinions)
-
-            for h_opinion in hypotheses_opinions:
-                for r_opinion in reference_opinions:
-                    if h_opinion == r_opinion:
-                        num_current_exact_matches += 1
-                    if h_opinion in r_opinion:
-                        num_current_inexact_matches += 1
-        exact_matches += num_current_exact_matches
-        inexact_matches += num_current_inexact_matches
-
-        exact_match_false_positives += num_current_hypotheses_items - num_current_exact_matches
-        inexact_match_false_positives += num_current_hypotheses_items - num_current_inexact_matches
-        
-        exact_match_false_negatives += num_current_reference_items - num_current_exact_matches
-        inexact_match_false_negatives += num_current_reference_items - num_current_inexact_matches
-
-    exact_precision = 0.
-    exact_recall = 0.
-
-    inexact_precision = 0.
-    inexact_recall = 0.
-
-    exact_precision = compute_accuracy(exact_matches, exact_match_false_positives)
-    exact_recall = compute_accuracy(exact_matches, exact_match_false_negatives)
-
-    inexact_precision = compute_accuracy(inexact_matches, inexact_match_false_positives)
-    inexact_recall = compute_accuracy(inexact_matches, inexact_match_false_negatives)
-    
-    print(f"Exact Precision {exact_precision} | Exact Recall {exact_recall}")
-    print(f"Inexact Precision {inexact_precision} | Inexact Recall {inexact_recall}")
-    
+LEXICON = DEFAULT_LEXICON.labels
+
+def compute_metrics(hypotheses, references, num_samples=1000):
+    """
+    We can define exact and inexact variants of precision and recall
+    that allow us to capture complete and partial matches.
+    Returns the structured results of metrics.evaluate.
+    """
+    results = evaluate(hypotheses, references, LEXICON, num_samples=num_samples)
+    overall = results["overall"]
+
+    print(f"Exact Precision {overall['exact_precision']['value']} | Exact Recall {overall['exact_recall']['value']}")
+    print(f"Inexact Precision {overall['inexact_precision']['value']} | Inexact Recall {overall['inexact_recall']['value']}")
+    return results
 
 
 def prepare_references(references):
@@ -98,7 +41,8 @@ def prepare_references(references):
 
     return processed_refs
 
-if __name__ == "__main__":
+def load_annotated_corpus():
+    "Texts of the annotated examples, each review once, and their references"
     references = get_annotated_examples_with_opinions()
 
     filtered_refs = []
@@ -110,10 +54,14 @@ if __name__ == "__main__":
             filtered_refs.append(references[i])
 
     texts = [ref[0] for ref in filtered_refs]
-    processed_refs = prepare_references(filtered_refs)
+    return texts, prepare_references(filtered_refs)
+
+if __name__ == "__main__":
+    texts, processed_refs = load_annotated_corpus()
 
-    pipeline = Pipeline()
+    # Spans and rule names let compute_metrics break results down per rule template
+    pipeline = Pipeline(track_spans=True)
 
-    hypotheses = pipeline.extract_descriptions(texts)
+    hypotheses = pipeline.extract_descriptions(texts, cache=ParseCache())
 
     compute_metrics(hypotheses, processed_refs)
\ No newline at end of file
@@ -0,0 +1,146 @@
+import argparse
+import hashlib
+import json
+import os
+
+from dataset import PROCESSED_DATA_PATH, ReviewStore
+from pipeline import DEFAULT_MODEL, EXTRACTION_VERSION, Pipeline, batched, cache_namespace
+
+"""
+Incremental extraction over a refreshed review dump. Results are
+appended to a JSON lines store keyed by review_id, and a review is only
+parsed again if it is new, its text changed or the extractor changed.
+
+    python incremental.py [--reviews PATH] [--store DIR] [--model NAME]
+"""
+
+DEFAULT_STORE_PATH = os.path.join(PROCESSED_DATA_PATH, "extractions")
+
+def _digest(*parts):
+    sha = hashlib.sha1()
+    for part in parts:
+        sha.update(part.encode("utf-8"))
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+def extractor_fingerprint(pipeline):
+    """
+    Hash of everything that decides a review's output: the version of
+    the extraction rules, their settings, the aspect lexicon, the
+    coreference settings, and the model name and version
+    """
+    settings = json.dumps({
+        "version": EXTRACTION_VERSION,
+        "rules": pipeline.parser.rules.to_dict(),
+        "track_spans": pipeline.parser.track_spans,
+        "terms": sorted(pipeline.lexicon.terms),
+        "plurals": pipeline.lexicon.plurals,
+        "anaphora": pipeline.lexicon.anaphora,
+        "coref": [pipeline.coref.resolver.name, pipeline.coref.max_distance] if pipeline.coref is not None else None,
+    }, sort_keys=True)
+    return _digest(settings, cache_namespace(pipeline.model))
+
+class IncrementalExtractor():
+    """
+    A directory holding results.jsonl, one {"review_id", "business_id",
+    "text_digest", "aspect_opinions"} line per extracted review, and
+    manifest.json with the extractor fingerprint the results were made
+    with. If the fingerprint no longer matches, the results are discarded
+    and every review is extracted again.
+    """
+    def __init__(self, pipeline, path=DEFAULT_STORE_PATH):
+        super().__init__()
+        self.pipeline = pipeline
+        self.path = path
+        self.results_path = os.path.join(path, "results.jsonl")
+        self.manifest_path = os.path.join(path, "manifest.json")
+        self.fingerprint = extractor_fingerprint(pipeline)
+        self.digests = {}
+
+        os.makedirs(path, exist_ok=True)
+        if self._manifest().get("fingerprint") == self.fingerprint:
+            self._load_digests()
+        else:
+            self.reset()
+
+    def _manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path) as manifest_file:
+            return json.load(manifest_file)
+
+    def _load_digests(self):
+        if not os.path.exists(self.results_path):
+            return
+        with open(self.results_path) as results_file:
+            for line in results_file:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    # A line cut short by an interrupted run, its review is extracted again
+                    continue
+                self.digests[result["review_id"]] = result["text_digest"]
+
+    def reset(self):
+        "Drop the stored results and record the current fingerprint"
+        self.digests = {}
+        open(self.results_path, 'w').close()
+        manifest_tmp = self.manifest_path + ".tmp"
+        with open(manifest_tmp, 'w') as manifest_file:
+            json.dump({"fingerprint": self.fingerprint, "model": cache_namespace(self.pipeline.model)}, manifest_file)
+        os.replace(manifest_tmp, self.manifest_path)
+
+    def pending(self, reviews):
+        "Review records that are new or whose text changed since they were extracted"
+        for review in reviews:
+            if self.digests.get(review["review_id"]) != _digest(review["text"]):
+                yield review
+
+    def update(self, reviews, batch_size=10000, **extract_kwargs):
+        """
+        Extract the pending reviews and append their results, flushing
+        after each batch so an interrupted run keeps its progress.
+        Returns the number of reviews extracted.
+        """
+        num_extracted = 0
+        with open(self.results_path, 'a') as results_file:
+            for batch in batched(self.pending(reviews), batch_size):
+                descriptions = self.pipeline.iter_descriptions([review["text"] for review in batch], batch_size=batch_size, **extract_kwargs)
+                for i, aspect_opinions in descriptions:
+                    review = batch[i]
+                    text_digest = _digest(review["text"])
+                    results_file.write(json.dumps({
+                        "review_id": review["review_id"],
+                        "business_id": review["business_id"],
+                        "text_digest": text_digest,
+                        "aspect_opinions": aspect_opinions,
+                    }) + "\n")
+                    self.digests[review["review_id"]] = text_digest
+                results_file.flush()
+                num_extracted += len(batch)
+        return num_extracted
+
+    def results(self):
+        "The latest result of every review, as dicts in the results.jsonl format"
+        latest = {}
+        with open(self.results_path) as results_file:
+            for line in results_file:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+                latest[result["review_id"]] = result
+        return latest.values()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reviews", default=os.path.join(PROCESSED_DATA_PATH, "italian_restaurant_reviews.json"))
+    parser.add_argument("--store", default=DEFAULT_STORE_PATH)
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--n-jobs", type=int, default=10)
+    args = parser.parse_args()
+
+    extractor = IncrementalExtractor(Pipeline(model=args.model), args.store)
+    store = ReviewStore(args.reviews)
+    print("Reviews:", len(store), "already extracted:", len(extractor.digests))
+    print("Extracted:", extractor.update(store, n_jobs=args.n_jobs))
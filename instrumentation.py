@@ -0,0 +1,91 @@
+import json
+import threading
+from collections import Counter, defaultdict
+
+"""
+Opt-in counters and timers for the extraction rules.
+
+    stats = ExtractionStats()
+    pipeline = Pipeline(stats=stats)
+    pipeline.extract_descriptions(texts)
+    print(stats.to_json())
+
+Pipeline and Parser only check `stats is not None` when no stats object
+is given, so instrumentation costs nothing unless it is enabled.
+
+Recorded families, each a Counter by label:
+    docs       parsed                     Docs given to _parse_review
+    tokens     visited, candidates        tokens in those Docs, and those flagged by the lexicon
+    branch     keyword, anaphora_<kind or none>, number, none
+                                          calls and seconds of each _parse_tokens branch
+    parser     direct_dependence, children
+                                          calls and seconds of the two halves of parse_zhuang_phrases
+    template   nsubj_acomp, amod_adj, amod_verb, nsubj_adj
+                                          phrases produced by each Parser template
+    stage      flag_tokens, matcher, merge
+                                          calls and seconds of the other per-Doc steps
+    matches    x_was_y                    'X was Y' matcher hits
+"""
+
+class ExtractionStats():
+    "Thread safe counts and cumulative seconds, keyed by family and label"
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self.counts = defaultdict(Counter)
+        self.seconds = defaultdict(Counter)
+
+    def count(self, family, label, n=1):
+        with self._lock:
+            self.counts[family][label] += n
+
+    def time(self, family, label, seconds):
+        "Count one call of family/label that took seconds"
+        with self._lock:
+            self.counts[family][label] += 1
+            self.seconds[family][label] += seconds
+
+    def merge(self, other):
+        "Add the stats of another ExtractionStats, e.g. from a worker process"
+        with self._lock:
+            for family, counts in other.counts.items():
+                self.counts[family].update(counts)
+            for family, seconds in other.seconds.items():
+                self.seconds[family].update(seconds)
+        return self
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+            self.seconds.clear()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "counts": {family: dict(counts) for family, counts in self.counts.items()},
+                "seconds": {family: dict(seconds) for family, seconds in self.seconds.items()},
+            }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def to_prometheus(self, prefix="opinion_mining"):
+        "Prometheus text exposition format, one counter per family"
+        stats = self.to_dict()
+        lines = []
+        for kind, suffix in (("counts", "total"), ("seconds", "seconds_total")):
+            for family, values in sorted(stats[kind].items()):
+                name = f"{prefix}_{family}_{suffix}"
+                lines.append(f"# TYPE {name} counter")
+                for label, value in sorted(values.items()):
+                    lines.append(f'{name}{{name="{label}"}} {value}')
+        return "\n".join(lines) + "\n"
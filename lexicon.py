@@ -0,0 +1,161 @@
+import json
+import os
+import re
+
+import numpy as np
+from spacy.attrs import LOWER, POS, DEP
+from spacy.parts_of_speech import IDS as POS_IDS
+from spacy.strings import hash_string
+from spacy.symbols import IDS as SYMBOL_IDS
+
+def string_id(string):
+    "The id a StringStore gives string: its symbol id if it has one, its hash otherwise"
+    return SYMBOL_IDS.get(string) or hash_string(string)
+
+NUM_ID = POS_IDS["NUM"]
+PRON_ID = POS_IDS["PRON"]
+NSUBJ_ID = string_id("nsubj")
+
+# The lexicon every module loads by default, override with $ASPECT_LEXICON.
+# mine_lexicon.py writes files in the same format.
+DEFAULT_LEXICON_PATH = os.environ.get(
+    "ASPECT_LEXICON", os.path.join(os.path.dirname(os.path.abspath(__file__)), "aspect_lexicon.json"))
+
+DEFAULT_ANAPHORA = {
+    'singular': ['it'],
+    'plural': ['they'],
+    'quantifier': ['every', 'everything'],
+}
+
+def trie_pattern(terms):
+    """
+    Regex source matching any of terms, factored into a trie so that
+    matching costs about the same for thousands of terms as for a few.
+    Where terms share a prefix the longest one matches.
+    """
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            pattern = "(?:" + pattern + ")?"
+        return pattern
+
+    return build(trie)
+
+class AspectLexicon():
+    """
+    The aspect terms, their plural forms and the anaphora words, compiled
+    to arrays of lowercase string ids. flag_tokens checks a whole Doc against
+    them with one Doc.to_array pass, so the rules only visit candidate
+    tokens and the lookup cost doesn't grow with the number of terms.
+
+    terms are the surface forms matched as direct mentions, plurals maps
+    a surface form to its aspect label (forms in plurals but not in terms
+    are only used by the 'X was Y' matcher).
+    """
+    def __init__(self, terms, plurals=None, anaphora=DEFAULT_ANAPHORA):
+        super().__init__()
+        self.terms = {term.lower() for term in terms}
+        self.plurals = {form.lower(): label.lower() for form, label in (plurals or {}).items()}
+        self.anaphora = {kind: [word.lower() for word in words] for kind, words in anaphora.items()}
+
+        self._term_labels = {string_id(term): self.label(term) for term in self.terms}
+        self._term_ids = np.asarray(sorted(self._term_labels), dtype="uint64")
+        self._anaphora_ids = np.asarray(
+            sorted({string_id(word) for words in self.anaphora.values() for word in words}), dtype="uint64")
+
+        self._label_pattern = None
+        self._contained_labels = {}
+
+        self._singular = set(self.anaphora.get('singular', []))
+        self._plural = set(self.anaphora.get('plural', []))
+        self._quantifier = set(self.anaphora.get('quantifier', []))
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as lexicon_file:
+            data = json.load(lexicon_file)
+        return cls(data["terms"], data.get("plurals", {}), data.get("anaphora", DEFAULT_ANAPHORA))
+
+    def to_file(self, path):
+        with open(path, 'w') as lexicon_file:
+            json.dump({
+                "terms": sorted(self.terms),
+                "plurals": dict(sorted(self.plurals.items())),
+                "anaphora": self.anaphora,
+            }, lexicon_file, indent=2)
+
+    def label(self, term):
+        "Aspect label of a lowercased surface form"
+        return self.plurals.get(term, term)
+
+    @property
+    def labels(self):
+        return sorted({self.label(term) for term in self.terms} | set(self.plurals.values()))
+
+    @property
+    def match_terms(self):
+        "Every surface form that can start an 'X was Y' match"
+        return self.terms | set(self.plurals)
+
+    def mentioned_labels(self, text):
+        """
+        Labels occurring anywhere in text, in lexicon order: the same as
+        testing `label in text.lower()` for every label, but in one regex
+        scan. Plurals and other surface forms are not looked for.
+        """
+        if self._label_pattern is None:
+            # The lookahead tries every position, and the labels inside each
+            # longest match cover the ones sharing its start or overlapping it
+            self._label_pattern = re.compile(f"(?=({trie_pattern(self.labels)}))")
+        found = set()
+        for match in self._label_pattern.finditer(text.lower()):
+            longest = match.group(1)
+            if longest not in self._contained_labels:
+                self._contained_labels[longest] = {label for label in self.labels if label in longest}
+            found.update(self._contained_labels[longest])
+        return [label for label in self.labels if label in found]
+
+    def anaphora_kind(self, token):
+        "'singular', 'plural', 'quantifier' or None, with the precedence _parse_anaphora expects"
+        lower = token.lower_
+        if lower in self._singular and token.pos == PRON_ID:
+            return 'singular'
+        if lower in self._plural and token.pos == PRON_ID:
+            return 'plural'
+        if lower in self._quantifier:
+            return 'quantifier'
+        return None
+
+    def flag_tokens(self, doc):
+        """
+        Indices of the tokens any extraction rule can act on, with the
+        aspect label of each index that is a direct mention (None otherwise)
+        and whether it is an anaphora word
+        """
+        if not len(doc):
+            return [], [], []
+        array = doc.to_array([LOWER, POS, DEP])
+        lowers = array[:, 0]
+        keyword = np.isin(lowers, self._term_ids)
+        anaphora = np.isin(lowers, self._anaphora_ids)
+        number = (array[:, 1] == NUM_ID) & (array[:, 2] == NSUBJ_ID)
+
+        candidates = np.flatnonzero(keyword | anaphora | number).tolist()
+        labels = [self._term_labels[int(lowers[i])] if keyword[i] else None for i in candidates]
+        is_anaphora = [bool(anaphora[i]) for i in candidates]
+        return candidates, labels, is_anaphora
+
+def load_lexicon(path=None):
+    return AspectLexicon.from_file(path or DEFAULT_LEXICON_PATH)
+
+DEFAULT_LEXICON = load_lexicon()
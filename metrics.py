@@ -0,0 +1,140 @@
+import numpy as np
+
+"""
+Precision and recall of extracted opinions against annotated references,
+overall, per aspect and per rule template, with bootstrap confidence
+intervals. The numbers follow evaluation.compute_metrics: per review and
+aspect the opinions are compared as sets, an exact match is an equal
+pair and an inexact match a hypothesis contained in a reference.
+"""
+
+UNKNOWN_RULE = "unknown"
+
+class MatchCounts():
+    """
+    Opinion and match counts as (num_reviews, num_aspects) matrices, plus
+    per hypothesis counts labelled with the rule template that produced
+    them. Matching is done once here, every score after that is sums over
+    these arrays.
+    """
+    def __init__(self, hypotheses, references, aspects):
+        super().__init__()
+        assert len(hypotheses) == len(references), "The lengths of hypotheses and references differ!"
+        self.aspects = list(aspects)
+        shape = (len(hypotheses), len(self.aspects))
+        self.hypotheses = np.zeros(shape, dtype=np.int64)
+        self.references = np.zeros(shape, dtype=np.int64)
+        self.exact = np.zeros(shape, dtype=np.int64)
+        self.inexact = np.zeros(shape, dtype=np.int64)
+
+        rules, hypothesis_reviews, hypothesis_exact, hypothesis_inexact = [], [], [], []
+        for review, (h, r) in enumerate(zip(hypotheses, references)):
+            for a, aspect in enumerate(self.aspects):
+                # First occurrence wins when the same phrase came from several rules
+                hypothesis_opinions = {}
+                for opinion in h.get(aspect, ()):
+                    hypothesis_opinions.setdefault(str(opinion), getattr(opinion, "rule", None) or UNKNOWN_RULE)
+                reference_opinions = set(r.get(aspect, ()))
+
+                self.hypotheses[review, a] = len(hypothesis_opinions)
+                self.references[review, a] = len(reference_opinions)
+                for opinion, rule in hypothesis_opinions.items():
+                    exact = int(opinion in reference_opinions)
+                    inexact = sum(opinion in reference for reference in reference_opinions)
+                    self.exact[review, a] += exact
+                    self.inexact[review, a] += inexact
+                    rules.append(rule)
+                    hypothesis_reviews.append(review)
+                    hypothesis_exact.append(exact)
+                    hypothesis_inexact.append(inexact)
+
+        self.rules = sorted(set(rules))
+        rule_ids = {rule: i for i, rule in enumerate(self.rules)}
+        self.hypothesis_rules = np.asarray([rule_ids[rule] for rule in rules], dtype=np.int64)
+        self.hypothesis_reviews = np.asarray(hypothesis_reviews, dtype=np.int64)
+        self.hypothesis_exact = np.asarray(hypothesis_exact, dtype=np.int64)
+        self.hypothesis_inexact = np.asarray(hypothesis_inexact, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.hypotheses)
+
+    def per_rule(self):
+        "(num_reviews, num_rules) matrices of hypotheses, exact and inexact matches by rule"
+        shape = (len(self), len(self.rules))
+        matrices = []
+        for weights in (None, self.hypothesis_exact, self.hypothesis_inexact):
+            matrix = np.zeros(shape, dtype=np.int64)
+            np.add.at(matrix, (self.hypothesis_reviews, self.hypothesis_rules), 1 if weights is None else weights)
+            matrices.append(matrix)
+        return matrices
+
+def _ratio(numerator, denominator):
+    "numerator / denominator, 0 where the denominator is 0"
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    return np.divide(numerator, denominator, out=np.zeros(np.broadcast(numerator, denominator).shape), where=denominator > 0)
+
+def bootstrap_weights(num_reviews, num_samples=1000, seed=0):
+    "(num_samples, num_reviews) counts of how often each review is drawn in each resample"
+    rng = np.random.RandomState(seed)
+    if num_reviews == 0:
+        return np.zeros((num_samples, 0), dtype=np.int64)
+    return rng.multinomial(num_reviews, np.full(num_reviews, 1. / num_reviews), size=num_samples)
+
+def _scores(hypotheses, references, exact, inexact, weights, alpha):
+    """
+    Scores from per review count vectors (or matrices, one column per
+    group), with confidence intervals from the resampled sums weights @ counts
+    """
+    totals = [counts.sum(axis=0) for counts in (hypotheses, references, exact, inexact)]
+    resampled = [weights @ counts for counts in (hypotheses, references, exact, inexact)]
+    quantiles = [100 * alpha / 2, 100 * (1 - alpha / 2)]
+
+    def score(matches, total, resampled_matches, resampled_total):
+        value = _ratio(matches, total)
+        low, high = np.percentile(_ratio(resampled_matches, resampled_total), quantiles, axis=0)
+        return value, low, high
+
+    return {
+        "hypotheses": totals[0],
+        "references": totals[1],
+        "exact_precision": score(totals[2], totals[0], resampled[2], resampled[0]),
+        "exact_recall": score(totals[2], totals[1], resampled[2], resampled[1]),
+        "inexact_precision": score(totals[3], totals[0], resampled[3], resampled[0]),
+        "inexact_recall": score(totals[3], totals[1], resampled[3], resampled[1]),
+    }
+
+def _group(scores, i=None):
+    "One group's scores as plain floats, {'value', 'ci'} per metric"
+    result = {}
+    for name, score in scores.items():
+        if isinstance(score, tuple):
+            value, low, high = (float(part if i is None else part[i]) for part in score)
+            result[name] = {"value": value, "ci": [low, high]}
+        else:
+            result[name] = int(score if i is None else score[i])
+    return result
+
+def evaluate(hypotheses, references, aspects, num_samples=1000, alpha=0.05, seed=0):
+    """
+    Scores with (1 - alpha) bootstrap confidence intervals over reviews:
+        {"overall": {...}, "per_aspect": {aspect: {...}}, "per_rule": {rule: {...}}}
+    Rules only label hypotheses, so a rule's recall is the share of all
+    references it matched. Rule labels come from Pipeline(track_spans=True),
+    other hypotheses count as 'unknown'.
+    """
+    counts = MatchCounts(hypotheses, references, aspects)
+    weights = bootstrap_weights(len(counts), num_samples, seed)
+
+    per_aspect = _scores(counts.hypotheses, counts.references, counts.exact, counts.inexact, weights, alpha)
+    overall = _scores(*(matrix.sum(axis=1) for matrix in (counts.hypotheses, counts.references, counts.exact, counts.inexact)), weights, alpha)
+    rule_hypotheses, rule_exact, rule_inexact = counts.per_rule()
+    references = np.repeat(counts.references.sum(axis=1, keepdims=True), len(counts.rules), axis=1)
+    per_rule = _scores(rule_hypotheses, references, rule_exact, rule_inexact, weights, alpha)
+
+    return {
+        "num_reviews": len(counts),
+        "overall": _group(overall),
+        "per_aspect": {aspect: _group(per_aspect, i) for i, aspect in enumerate(counts.aspects)},
+        "per_rule": {rule: _group(per_rule, i) for i, rule in enumerate(counts.rules)},
+    }
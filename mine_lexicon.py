@@ -0,0 +1,181 @@
+"""
+Mine an aspect lexicon from the review corpus in one streaming pass.
+The root nouns of noun chunks are counted by lemma with a space-saving
+counter, so memory stays bounded by --capacity however many distinct
+nouns the corpus holds, and the most frequent ones are written as a
+lexicon file that Pipeline, the matcher and the dataset filter load.
+
+    python mine_lexicon.py --top-k 2000 --min-count 20 --output aspect_lexicon.json
+
+Point $ASPECT_LEXICON at the output to use it instead of the default.
+"""
+
+import argparse
+import heapq
+import os
+from collections import Counter
+
+from tqdm.auto import tqdm
+
+from dataset import PROCESSED_DATA_PATH, ReviewStore
+from lexicon import DEFAULT_LEXICON, DEFAULT_LEXICON_PATH, AspectLexicon
+from parse_cache import ParseCache
+from pipeline import DEFAULT_MODEL, batched, preprocess_parallel
+
+# Frequent in any restaurant review, never a dish
+GENERIC_NOUNS = {
+    "food", "place", "restaurant", "service", "time", "staff", "server", "waiter", "waitress",
+    "menu", "order", "table", "meal", "dinner", "lunch", "night", "experience", "way", "thing",
+    "lot", "bit", "people", "friend", "family", "wife", "husband", "day", "year", "location",
+    "price", "star", "review", "spot", "side", "dish", "item", "area", "minute", "hour",
+    "owner", "manager", "kitchen", "bar", "atmosphere", "portion", "visit", "reservation",
+}
+
+class SpaceSaving():
+    """
+    Approximate top-k counter of Metwally et al. that holds at most
+    capacity items. An unseen item replaces the least counted one and
+    inherits its count, which is kept as the item's error, so an item's
+    true count lies between count - error and count. The minimum is
+    found with a lazily updated heap.
+    """
+    def __init__(self, capacity):
+        super().__init__()
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self._heap = []
+
+    def add(self, item, n=1):
+        "Count item, returning the item it evicted if any"
+        evicted = None
+        if item in self.counts:
+            self.counts[item] += n
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = n
+            self.errors[item] = 0
+        else:
+            evicted, minimum = self._pop_min()
+            del self.counts[evicted]
+            del self.errors[evicted]
+            self.counts[item] = minimum + n
+            self.errors[item] = minimum
+        heapq.heappush(self._heap, (self.counts[item], item))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(count, item) for item, count in self.counts.items()]
+            heapq.heapify(self._heap)
+        return evicted
+
+    def _pop_min(self):
+        # Entries whose count has grown since they were pushed are stale
+        while True:
+            count, item = heapq.heappop(self._heap)
+            if self.counts.get(item) == count:
+                return item, count
+
+    def guaranteed(self, item):
+        return self.counts[item] - self.errors[item]
+
+    def most_common(self, k=None):
+        return Counter(self.counts).most_common(k)
+
+def iter_review_texts(path):
+    with ReviewStore(path) as store:
+        for i in range(len(store)):
+            yield store.get(i)["text"]
+
+def candidate_nouns(doc):
+    "(lemma, lowercased surface form) of each noun chunk root that could name a dish"
+    for chunk in doc.noun_chunks:
+        root = chunk.root
+        if root.pos_ != "NOUN" or not root.is_alpha or root.is_stop or len(root.text) < 3:
+            continue
+        yield root.lemma_.lower(), root.lower_
+
+class LexiconMiner():
+    "Counts candidate nouns over streamed Docs, keeping the surface forms of the counted lemmas"
+    def __init__(self, capacity=100000, exclude=GENERIC_NOUNS):
+        super().__init__()
+        self.counter = SpaceSaving(capacity)
+        self.exclude = set(exclude)
+        self.forms = {}
+        self.num_docs = 0
+
+    def add_doc(self, doc):
+        self.num_docs += 1
+        for lemma, form in candidate_nouns(doc):
+            if lemma in self.exclude:
+                continue
+            evicted = self.counter.add(lemma)
+            if evicted is not None:
+                self.forms.pop(evicted, None)
+            self.forms.setdefault(lemma, Counter())[form] += 1
+
+    def candidates(self, min_count=1):
+        """
+        {label: (count, surface forms)} of the lemmas counted at least
+        min_count times for certain. A lemma ending in 's' is folded into
+        its singular when both were counted, for plurals the lemmatizer
+        doesn't know (e.g. 'gelatos').
+        """
+        candidates = {}
+        for lemma, count in self.counter.most_common():
+            if self.counter.guaranteed(lemma) >= min_count:
+                candidates[lemma] = (count, set(self.forms.get(lemma, ())) | {lemma})
+        for lemma in sorted(candidates, key=len, reverse=True):
+            singular = lemma[:-1]
+            if lemma.endswith("s") and singular in candidates:
+                count, forms = candidates.pop(lemma)
+                singular_count, singular_forms = candidates[singular]
+                candidates[singular] = (singular_count + count, singular_forms | forms)
+        return candidates
+
+    def lexicon(self, top_k=1000, min_count=1, extend=None):
+        "AspectLexicon of the top_k candidates, plus the terms of the lexicon extend if given"
+        candidates = sorted(self.candidates(min_count).items(), key=lambda item: -item[1][0])[:top_k]
+        terms = set()
+        plurals = {}
+        for label, (_, forms) in candidates:
+            terms.update(forms)
+            plurals.update({form: label for form in forms if form != label})
+        anaphora = DEFAULT_LEXICON.anaphora
+        if extend is not None:
+            terms.update(extend.terms)
+            plurals.update(extend.plurals)
+            anaphora = extend.anaphora
+        return AspectLexicon(terms, plurals, anaphora)
+
+def mine_lexicon(texts, model=DEFAULT_MODEL, capacity=100000, batch_size=10000, cache=None, **parse_kwargs):
+    "Stream texts through the parser once, in batches of batch_size, and return the LexiconMiner"
+    miner = LexiconMiner(capacity)
+    with tqdm(unit="reviews") as progress:
+        for batch in batched(texts, batch_size):
+            for doc in preprocess_parallel(batch, model=model, cache=cache, **parse_kwargs):
+                miner.add_doc(doc)
+            progress.update(len(batch))
+    return miner
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reviews", default=os.path.join(PROCESSED_DATA_PATH, "italian_restaurant_reviews.json"))
+    parser.add_argument("--output", default="mined_lexicon.json")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--top-k", type=int, default=1000)
+    parser.add_argument("--min-count", type=int, default=20)
+    parser.add_argument("--capacity", type=int, default=100000,
+        help="Distinct lemmas the counter holds, should be well above --top-k")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--n-jobs", type=int, default=10)
+    parser.add_argument("--extend", action="store_true",
+        help=f"Keep the terms of {DEFAULT_LEXICON_PATH} as well")
+    parser.add_argument("--cache", action="store_true", help="Read and write parses in the ParseCache")
+    args = parser.parse_args()
+
+    miner = mine_lexicon(iter_review_texts(args.reviews), args.model, args.capacity, args.batch_size,
+        cache=ParseCache() if args.cache else None, n_jobs=args.n_jobs)
+    lexicon = miner.lexicon(args.top_k, args.min_count, DEFAULT_LEXICON if args.extend else None)
+    lexicon.to_file(args.output)
+
+    print(f"Mined {len(lexicon.labels)} aspects from {miner.num_docs} reviews into {args.output}")
+    for label, (count, forms) in sorted(miner.candidates(args.min_count).items(), key=lambda item: -item[1][0])[:30]:
+        print(f"{count:>8} {label:<20} {', '.join(sorted(forms))}")
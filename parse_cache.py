@@ -0,0 +1,133 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import srsly
+
+DEFAULT_CACHE_PATH = os.path.join("processed_data", "parse_cache.sqlite")
+
+class ParseCache():
+    """
+    On-disk cache of compact parses (see pipeline.doc_to_parse), keyed
+    by a hash of the review text and a namespace naming the model and
+    its version. The total size of the stored parses is capped and the
+    least recently used entries are evicted first.
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=2 * 2 ** 30):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # One connection shared by the threads of AsyncPipeline and the server
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS parses ("
+            "key TEXT PRIMARY KEY, value BLOB, size INTEGER, last_used REAL)")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS parses_last_used ON parses (last_used)")
+        self._connection.commit()
+        self._total_bytes = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM parses").fetchone()[0]
+
+    @staticmethod
+    def _key(namespace, text):
+        return hashlib.sha1((namespace + "\0" + text).encode("utf-8")).hexdigest()
+
+    def get_many(self, namespace, texts, count=True):
+        """
+        Return a dict from text to cached parse for the texts present in
+        the cache. With count=False the lookups are left out of stats(),
+        for entries that are not parses.
+        """
+        with self._lock:
+            return self._get_many(namespace, texts, count)
+
+    def _get_many(self, namespace, texts, count):
+        keys = {self._key(namespace, text): text for text in texts}
+        found = {}
+        key_list = list(keys)
+        # Stay under SQLite's default limit on bound parameters
+        for start in range(0, len(key_list), 500):
+            batch = key_list[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._connection.execute(
+                f"SELECT key, value FROM parses WHERE key IN ({placeholders})", batch)
+            for key, value in rows:
+                found[keys[key]] = srsly.msgpack_loads(value)
+
+        now = time.time()
+        self._connection.executemany(
+            "UPDATE parses SET last_used = ? WHERE key = ?",
+            [(now, self._key(namespace, text)) for text in found])
+        self._connection.commit()
+
+        if not count:
+            return found
+        for text in texts:
+            if text in found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return found
+
+    def put_many(self, namespace, items):
+        "Store (text, parse) pairs, evicting old entries if the cache grows too large"
+        with self._lock:
+            self._put_many(namespace, items)
+
+    def _put_many(self, namespace, items):
+        now = time.time()
+        for text, parse in items:
+            key = self._key(namespace, text)
+            value = srsly.msgpack_dumps(parse)
+            previous = self._connection.execute(
+                "SELECT size FROM parses WHERE key = ?", (key,)).fetchone()
+            if previous:
+                self._total_bytes -= previous[0]
+            self._connection.execute(
+                "INSERT OR REPLACE INTO parses (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), now))
+            self._total_bytes += len(value)
+        self._evict()
+        self._connection.commit()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes:
+            rows = self._connection.execute(
+                "SELECT key, size FROM parses ORDER BY last_used LIMIT 1000").fetchall()
+            if not rows:
+                break
+            evicted = []
+            for key, size in rows:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                evicted.append((key,))
+                self._total_bytes -= size
+            self._connection.executemany("DELETE FROM parses WHERE key = ?", evicted)
+            self.evictions += len(evicted)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "bytes": self._total_bytes,
+        }
+
+    def clear(self):
+        self._connection.execute("DELETE FROM parses")
+        self._connection.commit()
+        self._total_bytes = 0
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,162 @@
+import json
+import os
+import multiprocessing
+
+import numpy as np
+from tqdm.auto import tqdm
+
+from pipeline import (
+    DEFAULT_MODEL,
+    batched,
+    doc_to_parse,
+    parse_to_doc,
+    preprocess_parallel,
+)
+
+"""
+Columnar store of parsed reviews, so rule extraction can be re-run
+without a spaCy model. Each column is a flat binary file over all
+tokens of the corpus (token text, lemma, POS, dependency label as ids into
+a shared string table, head index within the review and trailing space
+flags), and doc_offsets marks where each review starts. Sentence starts
+follow from the heads, as in pipeline.doc_to_parse.
+"""
+
+INT_COLUMNS = ["words", "lemmas", "pos", "deps", "heads"]
+BOOL_COLUMNS = ["spaces"]
+
+class ParseStoreWriter():
+    def __init__(self, path, model=DEFAULT_MODEL):
+        super().__init__()
+        self.path = path
+        self.model = model
+        os.makedirs(path, exist_ok=True)
+
+        self._strings = {}
+        self._num_tokens = 0
+        self._doc_offsets = [0]
+        self._files = {
+            column: open(os.path.join(path, column + ".bin"), "wb")
+            for column in INT_COLUMNS + BOOL_COLUMNS
+        }
+
+    def _string_id(self, string):
+        string_id = self._strings.get(string)
+        if string_id is None:
+            string_id = self._strings[string] = len(self._strings)
+        return string_id
+
+    def add(self, doc):
+        # Tags and entities are only read by coref.py, which needs a model anyway
+        words, spaces, pos, lemmas, deps, heads = doc_to_parse(doc)[:6]
+        columns = {
+            "words": [self._string_id(word) for word in words],
+            "lemmas": [self._string_id(lemma) for lemma in lemmas],
+            "pos": [self._string_id(tag) for tag in pos],
+            "deps": [self._string_id(dep) for dep in deps],
+            "heads": heads,
+        }
+        for column, values in columns.items():
+            np.asarray(values, dtype="int32").tofile(self._files[column])
+        np.asarray(spaces, dtype="bool").tofile(self._files["spaces"])
+
+        self._num_tokens += len(words)
+        self._doc_offsets.append(self._num_tokens)
+
+    def close(self):
+        for column_file in self._files.values():
+            column_file.close()
+        np.save(os.path.join(self.path, "doc_offsets.npy"), np.asarray(self._doc_offsets, dtype="int64"))
+        with open(os.path.join(self.path, "meta.json"), "w") as meta_file:
+            json.dump({
+                "model": self.model,
+                "num_docs": len(self._doc_offsets) - 1,
+                "num_tokens": self._num_tokens,
+                "strings": list(self._strings),
+            }, meta_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ParseStore():
+    "Read-only, memory-mapped view of a store written by ParseStoreWriter"
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as meta_file:
+            meta = json.load(meta_file)
+        self.model = meta["model"]
+        self.strings = meta["strings"]
+        self.doc_offsets = np.load(os.path.join(path, "doc_offsets.npy"), mmap_mode="r")
+
+        self.columns = {}
+        for column in INT_COLUMNS + BOOL_COLUMNS:
+            dtype = "int32" if column in INT_COLUMNS else "bool"
+            column_path = os.path.join(path, column + ".bin")
+            if meta["num_tokens"]:
+                self.columns[column] = np.memmap(column_path, dtype=dtype, mode="r")
+            else:
+                self.columns[column] = np.zeros(0, dtype=dtype)
+
+    def __len__(self):
+        return len(self.doc_offsets) - 1
+
+    def parse(self, i):
+        "Compact parse of the i-th review, in the format of pipeline.doc_to_parse"
+        start, end = self.doc_offsets[i], self.doc_offsets[i + 1]
+        strings = self.strings
+        columns = self.columns
+        return (
+            [strings[string_id] for string_id in columns["words"][start:end]],
+            columns["spaces"][start:end].tolist(),
+            [strings[string_id] for string_id in columns["pos"][start:end]],
+            [strings[string_id] for string_id in columns["lemmas"][start:end]],
+            [strings[string_id] for string_id in columns["deps"][start:end]],
+            columns["heads"][start:end].tolist(),
+        )
+
+    def iter_docs(self, vocab, start=0, end=None):
+        end = len(self) if end is None else end
+        for i in range(start, end):
+            yield i, parse_to_doc(vocab, self.parse(i))
+
+def build_parse_store(texts, path, model=DEFAULT_MODEL, batch_size=10000, **parse_kwargs):
+    "Parse texts in bounded batches and write them to a ParseStore at path"
+    with ParseStoreWriter(path, model=model) as writer:
+        for batch in batched(texts, batch_size):
+            for doc in preprocess_parallel(batch, model=model, **parse_kwargs):
+                writer.add(doc)
+    return ParseStore(path)
+
+def _extract_docs(pipeline, indexed_docs):
+    indices, docs = zip(*indexed_docs)
+    matches = pipeline._match_docs(docs)
+    return [(i, pipeline._parse_review(doc, doc_matches)) for i, doc, doc_matches in zip(indices, docs, matches)]
+
+def _extract_range(task):
+    pipeline, path, start, end = task
+    store = ParseStore(path)
+    return _extract_docs(pipeline, list(store.iter_docs(pipeline.vocab, start, end)))
+
+def iter_store_descriptions(pipeline, path, n_jobs=1, chunksize=1000):
+    """
+    Yield (index, aspect_opinions) for every review of the store at path.
+    Docs are rebuilt from the stored columns, so a Pipeline(model=None)
+    is enough, and with n_jobs > 1 ranges of reviews run in a process pool.
+    """
+    store = ParseStore(path)
+    if n_jobs == 1:
+        with tqdm(total=len(store)) as progress:
+            for indexed_docs in batched(store.iter_docs(pipeline.vocab), chunksize):
+                yield from _extract_docs(pipeline, indexed_docs)
+                progress.update(len(indexed_docs))
+        return
+
+    ranges = [(pipeline, path, start, min(start + chunksize, len(store)))
+        for start in range(0, len(store), chunksize)]
+    with multiprocessing.Pool(n_jobs) as pool:
+        for results in tqdm(pool.imap(_extract_range, ranges), total=len(ranges)):
+            yield from results
@@ -1,7 +1,10 @@
+from bisect import bisect_right
 from collections import defaultdict
+from itertools import islice
 import spacy
-from spacy.tokens import Token
-from spacy.matcher import Matcher
+from spacy.attrs import LOWER, POS, LEMMA, DEP, HEAD, TAG
+from spacy.parts_of_speech import IDS as POS_IDS
+from spacy.tokens import Doc, Span, Token
 
 import re
 # import neuralcoref
@@ -13,10 +16,159 @@ from concurrent.futures.thread import ThreadPoolExecutor
 
 from joblib import Parallel, delayed
 
+from lexicon import DEFAULT_LEXICON, string_id, trie_pattern
+from results import CompactResults
+
+import multiprocessing
+import numpy as np
 import os
+import resource
+import sys
+import threading
+import time
+
+DEFAULT_MODEL = 'en_core_web_lg'
+
+# Bump whenever a change to the extraction rules changes their output,
+# so that results stored by incremental.py are extracted again
+EXTRACTION_VERSION = 1
+
+# The rule extractor only reads the tagger and dependency parser output,
+# so these components are not loaded, unless coreference needs NER (see keep_ner)
+DISABLED_COMPONENTS = ("ner",)
+
+_models = {}
+_models_lock = threading.Lock()
+model_load_stats = {}
+_blank_vocab = None
+# model name -> exported .npy its vectors are memory-mapped from, see share_vectors
+_vector_paths = {}
+# models loaded with their NER component, see keep_ner
+_ner_models = set()
+
+VECTORS_PATH = "processed_data/vectors"
+
+def peak_memory_mb():
+    "Peak resident set size of this process in MB"
+    # Reported in KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+def resident_memory_mb():
+    "Current resident set size of this process in MB, the peak where /proc is missing"
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return peak_memory_mb()
+
+def load_model(model=DEFAULT_MODEL):
+    """
+    Load a spaCy model on first use and share it within the process.
+    Load time and resident memory growth are kept in model_load_stats.
+    """
+    if _needs_load(model):
+        # Threads may ask for the model at the same time, load it only once
+        with _models_lock:
+            if _needs_load(model):
+                rss_before = resident_memory_mb()
+                start = time.perf_counter()
+                disable = [name for name in DISABLED_COMPONENTS if not (name == "ner" and model in _ner_models)]
+                nlp = spacy.load(model, disable=disable)
+                if model in _vector_paths:
+                    _map_vectors(nlp, _vector_paths[model])
+                model_load_stats[model] = {
+                    "load_seconds": time.perf_counter() - start,
+                    "rss_mb": resident_memory_mb() - rss_before,
+                }
+                _models[model] = nlp
+                logging.info("Loaded %s in %.2fs (+%.0f MB RSS)", model,
+                    model_load_stats[model]["load_seconds"], model_load_stats[model]["rss_mb"])
+    return _models[model]
+
+def _needs_load(model):
+    nlp = _models.get(model)
+    return nlp is None or (model in _ner_models and "ner" not in nlp.pipe_names)
+
+def keep_ner(model=DEFAULT_MODEL):
+    """
+    Load the model with its NER component, in this process and in
+    ParsePool workers started afterwards, for the mentions of coref.py.
+    A copy already loaded without it is replaced on its next use, so call
+    this before parsing, as Pipeline does when it has a CorefStage.
+    """
+    with _models_lock:
+        _ner_models.add(model)
+
+def _map_vectors(nlp, path):
+    "Swap the model's vectors table for a read-only memory map of path"
+    from spacy._ml import link_vectors_to_models
+
+    nlp.vocab.vectors.data = np.load(path, mmap_mode="r")
+    # The models look their vectors up in thinc's table, point it at the map
+    link_vectors_to_models(nlp.vocab)
+
+def export_vectors(model=DEFAULT_MODEL, directory=VECTORS_PATH):
+    """
+    Save the model's vectors table as an .npy that processes can
+    memory-map, once per model version. Returns its path.
+    """
+    nlp = load_model(model)
+    path = os.path.join(directory, f"{model}-{nlp.meta.get('version', '')}.npy")
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = path + ".tmp.npy"
+        np.save(tmp_path, np.ascontiguousarray(nlp.vocab.vectors.data))
+        os.replace(tmp_path, path)
+    return path
+
+def share_vectors(model=DEFAULT_MODEL, directory=VECTORS_PATH):
+    """
+    Memory-map the model's vectors from an exported .npy, in this process
+    and in ParsePool workers started afterwards. All processes then share
+    the same page cache pages instead of each holding its own copy.
+    """
+    path = export_vectors(model, directory)
+    with _models_lock:
+        _vector_paths[model] = path
+        if model in _models:
+            _map_vectors(_models[model], path)
+    return path
+
+def blank_vocab():
+    """
+    English vocab without any trained model, enough to rebuild Docs from
+    stored parses and to run the matcher over them
+    """
+    global _blank_vocab
+    if _blank_vocab is None:
+        _blank_vocab = spacy.blank("en").vocab
+    return _blank_vocab
+
+def _measure_model_load(model, results, vectors_path=None):
+    _init_parse_worker(model, vectors_path)
+    results[model] = model_load_stats[model]
 
-nlp = spacy.load('en_core_web_lg')
-# neuralcoref.add_to_pipe(nlp)
+def report_model_footprint(models=('en_core_web_sm', 'en_core_web_md', 'en_core_web_lg'), shared_vectors=False):
+    """
+    Load each model in a fresh process and report its startup time
+    and resident memory, so that models don't inflate each other's numbers.
+    With shared_vectors, the processes map exported vectors like ParsePool
+    workers with shared_vectors do.
+    """
+    context = multiprocessing.get_context("spawn")
+    vector_paths = {model: export_vectors(model) for model in models} if shared_vectors else {}
+    with context.Manager() as manager:
+        results = manager.dict()
+        for model in models:
+            process = context.Process(target=_measure_model_load, args=(model, results, vector_paths.get(model)))
+            process.start()
+            process.join()
+        report = {model: results[model] for model in models if model in results}
+
+    for model, stats in report.items():
+        print(f"{model}: {stats['load_seconds']:.2f}s, {stats['rss_mb']:.0f} MB")
+    return report
 
 """
 Code copied and slightly tweaked from:
@@ -25,31 +177,437 @@ https://prrao87.github.io/blog/spacy/nlp/performance/2020/05/02/spacy-multiproce
 def chunker(iterable, total_length, chunksize):
     return (iterable[pos: pos + chunksize] for pos in range(0, total_length, chunksize))
 
+def batched(iterable, batch_size):
+    "Split any iterable into lists of at most batch_size items"
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
 def flatten(list_of_lists):
     "Flatten a list of lists to a combined list"
     return [item for sublist in list_of_lists for item in sublist]
 
-def process_chunk(texts):
+def process_chunk(texts, model=DEFAULT_MODEL, batch_size=20, length_batching=None):
+    nlp = load_model(model)
     preproc_pipe = []
-    for doc in tqdm(nlp.pipe(texts, batch_size=20, disable=["ner"])):
+    for doc in tqdm(pipe_texts(nlp, texts, batch_size, length_batching)):
         preproc_pipe.append(doc)
     return preproc_pipe
 
-def preprocess_parallel(texts, chunksize=1000):
-    executor = Parallel(n_jobs=10, backend='threading', prefer="processes")
+def pipe_texts(nlp, texts, batch_size=20, length_batching=None):
+    "nlp.pipe with fixed-size batches, or batches packed by LengthBatching"
+    if length_batching is None:
+        return nlp.pipe(texts, batch_size=batch_size)
+    return length_batching.pipe(nlp, texts)
+
+def doc_to_parse(doc):
+    """
+    Compact, picklable form of a parsed Doc holding only what the
+    rule extractor and coref.py read: words, trailing spaces, POS, lemma,
+    dependency label, absolute head index, fine-grained tag and
+    [start, end, label] entity spans. Sentence starts follow from the heads.
+    """
+    return (
+        [token.text for token in doc],
+        [bool(token.whitespace_) for token in doc],
+        [token.pos_ for token in doc],
+        [token.lemma_ for token in doc],
+        [token.dep_ for token in doc],
+        [token.head.i for token in doc],
+        [token.tag_ for token in doc],
+        [[ent.start, ent.end, ent.label_] for ent in doc.ents],
+    )
+
+def parse_to_doc(vocab, parse):
+    "Rebuild a Doc from the output of doc_to_parse"
+    words, spaces, pos, lemmas, deps, heads = parse[:6]
+    # Parses cached before tags and entities were kept have six fields
+    tags, ents = parse[6:] if len(parse) > 6 else ([], [])
+    doc = Doc(vocab, words=words, spaces=spaces)
+    if not words:
+        return doc
+    strings = vocab.strings
+    if tags:
+        # Set first, since assigning a tag may also set a POS from the tag map
+        doc.from_array([TAG], np.array([[strings.add(tag)] for tag in tags], dtype="uint64"))
+    array = np.zeros((len(words), 4), dtype="uint64")
+    for i in range(len(words)):
+        array[i, 0] = POS_IDS[pos[i]]
+        array[i, 1] = strings.add(lemmas[i])
+        array[i, 2] = strings.add(deps[i])
+        # spaCy stores heads relative to the token, wrapped like its own to_array output
+        array[i, 3] = (heads[i] - i) % 2 ** 64
+    doc.from_array([POS, LEMMA, DEP, HEAD], array)
+    if ents:
+        doc.ents = [Span(doc, start, end, label=label) for start, end, label in ents]
+    return doc
+
+def concat_parses(parses):
+    "Join the compact parses of consecutive pieces of a text into one"
+    joined = ([], [], [], [], [], [], [], [])
+    for words, spaces, pos, lemmas, deps, heads, tags, ents in parses:
+        offset = len(joined[0])
+        joined[0].extend(words)
+        joined[1].extend(spaces)
+        joined[2].extend(pos)
+        joined[3].extend(lemmas)
+        joined[4].extend(deps)
+        joined[5].extend(head + offset for head in heads)
+        joined[6].extend(tags)
+        joined[7].extend([start + offset, end + offset, label] for start, end, label in ents)
+    return joined
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+class LengthBatching():
+    """
+    Packs texts into nlp.pipe batches by an estimated token budget,
+    shortest first, instead of a fixed number of documents, so a few very
+    long reviews don't stall a whole batch. Reviews longer than
+    max_doc_tokens are parsed as windows of whole sentences and stitched
+    back together in order, so sentence ranks follow the original text.
+    """
+    def __init__(self, max_batch_tokens=4000, max_doc_tokens=500):
+        super().__init__()
+        self.max_batch_tokens = max_batch_tokens
+        self.max_doc_tokens = max_doc_tokens
+
+    @staticmethod
+    def estimate_tokens(text):
+        return len(text.split())
+
+    def split_windows(self, text):
+        "Slices of text, cut after sentence-final whitespace, that concatenate back to text"
+        windows = []
+        window_start = 0
+        window_tokens = 0
+        sentence_start = 0
+        ends = [match.end() for match in SENTENCE_BOUNDARY.finditer(text)] + [len(text)]
+        for sentence_end in ends:
+            sentence_tokens = self.estimate_tokens(text[sentence_start:sentence_end])
+            if window_tokens and window_tokens + sentence_tokens > self.max_doc_tokens:
+                windows.append(text[window_start:sentence_start])
+                window_start = sentence_start
+                window_tokens = 0
+            window_tokens += sentence_tokens
+            sentence_start = sentence_end
+        windows.append(text[window_start:])
+        return windows
+
+    def batches(self, lengths):
+        "Group indices into batches within the token budget, in order of length"
+        batch = []
+        batch_tokens = 0
+        for i in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+            if batch and batch_tokens + lengths[i] > self.max_batch_tokens:
+                yield batch
+                batch = []
+                batch_tokens = 0
+            batch.append(i)
+            batch_tokens += lengths[i]
+        if batch:
+            yield batch
+
+    def pipe(self, nlp, texts):
+        "Parse texts and return their Docs in input order"
+        windows = []
+        for text in texts:
+            if self.estimate_tokens(text) > self.max_doc_tokens:
+                windows.append(self.split_windows(text))
+            else:
+                windows.append([text])
+        units = [(i, window) for i, text_windows in enumerate(windows) for window in text_windows]
+        lengths = [self.estimate_tokens(window) for _, window in units]
+
+        unit_docs = [None] * len(units)
+        for batch in self.batches(lengths):
+            batch_docs = nlp.pipe([units[j][1] for j in batch], batch_size=len(batch))
+            for j, doc in zip(batch, batch_docs):
+                unit_docs[j] = doc
+
+        docs = []
+        position = 0
+        for text_windows in windows:
+            pieces = unit_docs[position:position + len(text_windows)]
+            position += len(text_windows)
+            if len(pieces) == 1:
+                docs.append(pieces[0])
+            else:
+                docs.append(parse_to_doc(nlp.vocab, concat_parses(doc_to_parse(piece) for piece in pieces)))
+        return docs
+
+def _init_parse_worker(model, vectors_path=None, ner=False):
+    if vectors_path is not None:
+        _vector_paths[model] = vectors_path
+    if ner:
+        _ner_models.add(model)
+    load_model(model)
+
+def _process_chunk_compact(texts, model=DEFAULT_MODEL, batch_size=20, length_batching=None):
+    return [doc_to_parse(doc) for doc in pipe_texts(load_model(model), texts, batch_size, length_batching)]
+
+class ParsePool():
+    """
+    Process pool whose workers each load the spaCy model once and
+    send back compact parses instead of pickled Docs, which are rebuilt
+    against the local vocab.
+
+    With shared_vectors, workers memory-map one copy of the vectors (see
+    share_vectors). With start_method="fork", the model is loaded before
+    the workers are forked, so they also share the parent's weights
+    copy-on-write instead of loading their own.
+    """
+    def __init__(self, model=DEFAULT_MODEL, n_jobs=None, batch_size=20, length_batching=None, shared_vectors=False, start_method=None):
+        super().__init__()
+        self.model = model
+        self.n_jobs = n_jobs or os.cpu_count()
+        self.batch_size = batch_size
+        self.length_batching = length_batching
+        if shared_vectors:
+            share_vectors(model)
+        if start_method == "fork":
+            load_model(model)
+        self._pool = multiprocessing.get_context(start_method).Pool(
+            self.n_jobs,
+            initializer=_init_parse_worker,
+            initargs=(model, _vector_paths.get(model), model in _ner_models))
+
+    def parse(self, texts, chunksize=1000):
+        chunks = chunker(texts, len(texts), chunksize=chunksize)
+        tasks = [(chunk, self.model, self.batch_size, self.length_batching) for chunk in chunks]
+        parses = flatten(self._pool.starmap(_process_chunk_compact, tasks))
+        vocab = load_model(self.model).vocab
+        return [parse_to_doc(vocab, parse) for parse in parses]
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def cache_namespace(model=DEFAULT_MODEL):
+    """
+    Parse cache namespace, so that parses from other models or versions,
+    or without the entities coref.py needs, are never reused
+    """
+    nlp = load_model(model)
+    namespace = f"{model}-{nlp.meta.get('version', '')}"
+    return namespace + "-ner" if "ner" in nlp.pipe_names else namespace
+
+def preprocess_parallel(texts, chunksize=1000, n_jobs=10, backend='threading', pool=None, model=DEFAULT_MODEL, cache=None, batch_size=20, length_batching=None):
+    """
+    backend='threading' shares one loaded model between threads,
+    backend='processes' parses in a ParsePool (a temporary one is
+    created if `pool` is not given).
+    With a ParseCache, only texts missing from the cache are parsed.
+    With LengthBatching, nlp.pipe batches are packed by token count
+    instead of batch_size.
+    """
+    if cache is None:
+        return _parse_texts(texts, chunksize, n_jobs, backend, pool, model, batch_size, length_batching)
+
+    namespace = cache_namespace(model)
+    cached = cache.get_many(namespace, texts)
+    missing = [text for text in dict.fromkeys(texts) if text not in cached]
+
+    parsed = {}
+    if missing:
+        docs = _parse_texts(missing, chunksize, n_jobs, backend, pool, model, batch_size, length_batching)
+        parsed = dict(zip(missing, docs))
+        cache.put_many(namespace, [(text, doc_to_parse(doc)) for text, doc in parsed.items()])
+
+    vocab = load_model(model).vocab
+    return [parsed[text] if text in parsed else parse_to_doc(vocab, cached[text]) for text in texts]
+
+def _parse_texts(texts, chunksize, n_jobs, backend, pool, model, batch_size, length_batching):
+    if backend == 'processes':
+        if pool is not None:
+            return pool.parse(texts, chunksize=chunksize)
+        with ParsePool(model=model, n_jobs=n_jobs, batch_size=batch_size, length_batching=length_batching) as pool:
+            return pool.parse(texts, chunksize=chunksize)
+
+    # Load up front so the threads don't race to load the model
+    load_model(model)
+    executor = Parallel(n_jobs=n_jobs, backend='threading', prefer="processes")
     do = delayed(process_chunk)
-    tasks = (do(chunk) for chunk in chunker(texts, len(texts), chunksize=chunksize))
+    tasks = (do(chunk, model, batch_size, length_batching) for chunk in chunker(texts, len(texts), chunksize=chunksize))
     result = executor(tasks)
     return flatten(result)
 
+class AspectPrefilter():
+    """
+    Single regex over the lowercased review that tells whether it
+    contains any lexicon term. A review without one has no mentions for
+    the keyword, anaphora, number or matcher rules to attach opinions to,
+    so it can skip parsing altogether.
+    """
+    def __init__(self, terms):
+        super().__init__()
+        # No word boundaries: a review the tokenizer would split into a
+        # lexicon token must never be dropped. The trie keeps the search
+        # cost flat as the lexicon grows to thousands of dishes
+        self._pattern = re.compile(trie_pattern(terms))
+
+        # The server's batcher and the async pipeline's threads share one prefilter
+        self._lock = threading.Lock()
+        self.reviews_kept = 0
+        self.reviews_skipped = 0
+        self.filter_seconds = 0.
+        self.parse_seconds = 0.
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __call__(self, text):
+        start = time.perf_counter()
+        keep = self._pattern.search(text.lower()) is not None
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self.filter_seconds += seconds
+            if keep:
+                self.reviews_kept += 1
+            else:
+                self.reviews_skipped += 1
+        return keep
+
+    def reset(self):
+        with self._lock:
+            self.reviews_kept = 0
+            self.reviews_skipped = 0
+            self.filter_seconds = 0.
+            self.parse_seconds = 0.
+
+    def record_parse(self, seconds):
+        "Time spent parsing the kept reviews, used to estimate the time saved"
+        with self._lock:
+            self.parse_seconds += seconds
+
+    def stats(self):
+        with self._lock:
+            seconds_per_review = self.parse_seconds / self.reviews_kept if self.reviews_kept else 0.
+            return {
+                "reviews_kept": self.reviews_kept,
+                "reviews_skipped": self.reviews_skipped,
+                "filter_seconds": self.filter_seconds,
+                "estimated_seconds_saved": self.reviews_skipped * seconds_per_review - self.filter_seconds,
+            }
+
+class AssociationMatcher():
+    """
+    Finds 'X was Y' associations: an aspect term, a form of "be" and an
+    adjective, like a spaCy Matcher with the pattern
+        [{"LOWER": {"IN": terms}}, {"LEMMA": "be"}, {"POS": "ADJ"}]
+    pipe() tests a whole batch of Docs at once on their concatenated token
+    arrays, so the cost is linear in the number of tokens.
+    """
+    match_id = string_id("XwasY")
+    be_id = string_id("be")
+    adj_id = POS_IDS["ADJ"]
+
+    def __init__(self, terms):
+        super().__init__()
+        self.term_ids = np.asarray(sorted({string_id(term) for term in terms}), dtype="uint64")
+
+    def __call__(self, doc):
+        return self.pipe([doc])[0]
+
+    def pipe(self, docs):
+        "(match_id, start, end) lists in the order of docs"
+        docs = list(docs)
+        matches = [[] for _ in docs]
+        arrays = [doc.to_array([LOWER, LEMMA, POS]) for doc in docs if len(doc)]
+        if not arrays:
+            return matches
+        array = np.concatenate(arrays)
+        offsets = np.cumsum([0] + [len(doc) for doc in docs])
+
+        starts = np.flatnonzero(
+            np.isin(array[:-2, 0], self.term_ids) & (array[1:-1, 1] == self.be_id) & (array[2:, 2] == self.adj_id))
+        # Drop matches running over the end of a Doc into the next one
+        doc_indices = np.searchsorted(offsets, starts, side="right") - 1
+        within_doc = starts + 3 <= offsets[doc_indices + 1]
+        for doc_index, start in zip(doc_indices[within_doc].tolist(), starts[within_doc].tolist()):
+            start -= int(offsets[doc_index])
+            matches[doc_index].append((self.match_id, start, start + 3))
+        return matches
+
 DEBUG = False
 def dprint(*args, **kwargs):
     if DEBUG:
         print(*args,*kwargs)
 
+class Phrase(str):
+    """
+    An opinion phrase that remembers the doc[start:end] token span it was
+    built from and the name of the rule template that extracted it
+    """
+    def __new__(cls, text, start, end, rule=None):
+        phrase = super().__new__(cls, text)
+        phrase.start = start
+        phrase.end = end
+        phrase.rule = rule
+        return phrase
+
+    def __reduce__(self):
+        return Phrase, (str(self), self.start, self.end, self.rule)
+
+class RuleConfig():
+    """
+    The tunable parts of the extraction rules:
+    modifier_deps      children kept around an opinion adjective ("very", "and")
+    complement_deps    verb children taken as the opinion in NN <-nsubj- VB -dep-> JJ
+    negation_deps      verb children prepended as a negation
+    mention_window     how many sentences back an anaphora can find its mention,
+                       None for no limit
+    """
+    def __init__(self, modifier_deps=("advmod", "npadvmod", "cc", "conj"), complement_deps=("acomp", "attr"), negation_deps=("neg",), mention_window=None):
+        super().__init__()
+        self.modifier_deps = frozenset(modifier_deps)
+        self.complement_deps = frozenset(complement_deps)
+        self.negation_deps = frozenset(negation_deps)
+        self.mention_window = mention_window
+
+    def to_dict(self):
+        return {
+            "modifier_deps": sorted(self.modifier_deps),
+            "complement_deps": sorted(self.complement_deps),
+            "negation_deps": sorted(self.negation_deps),
+            "mention_window": self.mention_window,
+        }
+
+    def __repr__(self):
+        return f"RuleConfig({', '.join(f'{name}={value!r}' for name, value in self.to_dict().items())})"
+
+DEFAULT_RULES = RuleConfig()
+
 class Parser():
-    def __init__(self):
+    def __init__(self, track_spans=False, rules=DEFAULT_RULES, stats=None):
         super().__init__()
+        self.track_spans = track_spans
+        self.rules = rules
+        self.stats = stats
+
+    def _phrase(self, tokens, rule):
+        "Join the tokens' text, as a Phrase if spans are tracked"
+        text = " ".join(token.text for token in tokens)
+        if self.stats is not None:
+            self.stats.count("template", rule)
+        if self.track_spans:
+            return Phrase(text, min(token.i for token in tokens), max(token.i for token in tokens) + 1, rule)
+        return text
 
     def _extract_direct_dependence(self, token):
         parses = []
@@ -57,10 +615,10 @@ class Parser():
         negation = False
         negword = None
         for headchild in token.head.children:
-            if headchild.dep_ in ["neg"]:
+            if headchild.dep_ in self.rules.negation_deps:
                 negation = True
-                negword = headchild.text
-            if headchild.dep_ in ["acomp", "attr"] and headchild.pos_ == "ADJ":
+                negword = headchild
+            if headchild.dep_ in self.rules.complement_deps and headchild.pos_ == "ADJ":
 
                 modified_phrase = []
 
@@ -68,15 +626,15 @@ class Parser():
                     modified_phrase.append(negword)
 
                 for headgrandchild in headchild.lefts:
-                    if headgrandchild.dep_ in ["advmod", "npadvmod", "cc", "conj"]:
+                    if headgrandchild.dep_ in self.rules.modifier_deps:
 
-                        modified_phrase.append(headgrandchild.text)
-                modified_phrase.append(headchild.text)
+                        modified_phrase.append(headgrandchild)
+                modified_phrase.append(headchild)
                 for headgrandchild in headchild.rights:
-                    if headgrandchild.dep_ in ["advmod", "npadvmod", "cc", "conj"]:
+                    if headgrandchild.dep_ in self.rules.modifier_deps:
 
-                        modified_phrase.append(headgrandchild.text)
-                parses.append(" ".join(modified_phrase))
+                        modified_phrase.append(headgrandchild)
+                parses.append(self._phrase(modified_phrase, "nsubj_acomp"))
         
         return parses
 
@@ -98,6 +656,10 @@ class Parser():
         4. NN <-nsubj- JJ -advmod-> ADV (-advmod-> ADV )* (the pizza is very good and delicious)
         
         """
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter()
+
         parses = []
         if token.dep_ == "nsubj":
             # Token is a noun subject, so we can find adjective clasuses
@@ -107,6 +669,9 @@ class Parser():
             # find the opinion of its head token
             parses = self._extract_direct_dependence(token.head)
 
+        if stats is not None:
+            children_start = time.perf_counter()
+            stats.time("parser", "direct_dependence", children_start - start)
         if parses:
             return parses
         
@@ -114,52 +679,52 @@ class Parser():
             if child.dep_ == "amod" and child.pos_ == "ADJ":
                 modified_phrase = []
                 for subchild in child.lefts:
-                    if subchild.dep_ in ["advmod", "npadvmod", "cc", "conj"]:
-                        modified_phrase.append(subchild.text)
-                modified_phrase.append(child.text)
+                    if subchild.dep_ in self.rules.modifier_deps:
+                        modified_phrase.append(subchild)
+                modified_phrase.append(child)
                 for subchild in child.rights:
-                    if subchild.dep_ in ["advmod", "npadvmod", "cc", "conj"]:
-                        modified_phrase.append(subchild.text)
-                parses.append(" ".join(modified_phrase))
+                    if subchild.dep_ in self.rules.modifier_deps:
+                        modified_phrase.append(subchild)
+                parses.append(self._phrase(modified_phrase, "amod_adj"))
 
             elif child.dep_ == "amod" and child.pos_ == "VERB":
                 modified_phrase = []
                 for subchild in child.children:
                     if subchild.dep_ == "advmod":
-                        modified_phrase.append(subchild.text)
-                modified_phrase.append(child.text)
-                parses.append(" ".join(modified_phrase))
+                        modified_phrase.append(subchild)
+                modified_phrase.append(child)
+                parses.append(self._phrase(modified_phrase, "amod_verb"))
             elif child.dep_ == "nsubj" and child.pos_ == "ADJ":
-                parses.append(child.text)
+                parses.append(self._phrase([child], "nsubj_adj"))
 
+        if stats is not None:
+            stats.time("parser", "children", time.perf_counter() - children_start)
         return parses
 
 class Pipeline():
-    def __init__(self, model='en_core_web_md'):
+    def __init__(self, model=DEFAULT_MODEL, lexicon=DEFAULT_LEXICON, track_spans=False, rules=DEFAULT_RULES, stats=None, coref=None):
         super().__init__()
-        # self.nlp = spacy.load(model)
-        # neuralcoref.add_to_pipe(self.nlp)
+        # The model is only loaded once parsing or matching needs it.
+        # With model=None the pipeline can only extract from stored parses.
+        self.model = model
+        self._matcher = None
         self._configure_tokenizer()
-        self._configure_matcher()
         # We treat entities and aspects to be the same
-        self.aspect_lexicon = {
-            'bruschetta',
-            'pizza',
-            'pizzas',
-            'lasagna',
-            'gnocchi',
-            'gelato',
-            'gelatos'
-        }
-
-        self.plural_aspects = {
-            'pizzas': 'pizza',
-            'gelatos': 'gelato',
-            'bruschettas': 'bruschetta',
-            'lasagne': 'lasagna'
-        }
+        self.lexicon = lexicon
+        self.aspect_lexicon = lexicon.terms
+        self.plural_aspects = lexicon.plurals
 
-        self.parser = Parser()
+        # With track_spans, opinions are Phrases carrying their token span and rule
+        self.parser = Parser(track_spans=track_spans, rules=rules, stats=stats)
+        # An instrumentation.ExtractionStats to count and time each rule
+        # branch, None to skip instrumentation altogether
+        self.stats = stats
+        self.prefilter = AspectPrefilter(lexicon.match_terms)
+        # A coref.CorefStage resolving pronouns before the anaphora rules,
+        # on Docs parsed with NER, which its mention detection needs
+        self.coref = coref
+        if coref is not None and model is not None:
+            keep_ner(model)
 
         # Only doing from 1 to 5 for now since there are only 5 items
         # Possible extension is to chunk numbers together
@@ -171,6 +736,36 @@ class Pipeline():
             'five': 5,
         }
 
+    def __getstate__(self):
+        # The matcher is cheap to rebuild from the lexicon on the other side
+        state = self.__dict__.copy()
+        state["_matcher"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._configure_tokenizer()
+        if self.coref is not None and self.model is not None:
+            keep_ner(self.model)
+
+    @property
+    def nlp(self):
+        if self.model is None:
+            raise ValueError("This Pipeline has no model and can only extract from stored parses")
+        return load_model(self.model)
+
+    @property
+    def vocab(self):
+        if self.model is None:
+            return blank_vocab()
+        return self.nlp.vocab
+
+    @property
+    def matcher(self):
+        if self._matcher is None:
+            self._configure_matcher()
+        return self._matcher
+
     def _numericalize_value(self, token):
         return self.word_to_number.get(token.text.lower())
 
@@ -193,40 +788,60 @@ class Pipeline():
         def is_resolved_pronoun(token):
             return token._.in_coref and token.pos_ == "PRON"
 
-        Token.set_extension("is_pronominal", getter=is_pronominal)
-        Token.set_extension("is_resolved_pronoun", getter=is_resolved_pronoun)
-        Token.set_extension("is_quantifier", getter=is_quantifier)
-        Token.set_extension("is_anaphora", getter=is_anaphora)
-        Token.set_extension("is_singular_item", getter=is_singular_item)
-        Token.set_extension("is_plural_item", getter=is_plural_item)
+        Token.set_extension("is_pronominal", getter=is_pronominal, force=True)
+        Token.set_extension("is_resolved_pronoun", getter=is_resolved_pronoun, force=True)
+        Token.set_extension("is_quantifier", getter=is_quantifier, force=True)
+        Token.set_extension("is_anaphora", getter=is_anaphora, force=True)
+        Token.set_extension("is_singular_item", getter=is_singular_item, force=True)
+        Token.set_extension("is_plural_item", getter=is_plural_item, force=True)
 
     def _configure_matcher(self):
-        self.matcher = Matcher(nlp.vocab)
-
-        simple_association_pattern = [
-            {"LOWER": {"IN": ["pizza", "gnocchi", "bruschetta", "gelato", "lasagna"]}},
-            {"LEMMA": "be"},
-            {"POS": "ADJ"}]
-        plural_association_pattern = [
-            {"LOWER": {"IN": ["pizzas", "gnocchi", "bruschetta", "gelatos", "lasagne"]}},
-            {"LEMMA": "be"},
-            {"POS": "ADJ"}
-        ]
-        self.matcher.add("XwasY", None, simple_association_pattern)
-        self.matcher.add("pluralXwasY", None, plural_association_pattern)
+        # Singular and plural forms share one pattern, labels are
+        # de-pluralized when the matches are merged
+        self._matcher = AssociationMatcher(self.lexicon.match_terms)
 
     def _process_matched_aspect_label(self, token):
-        text = token.text.lower()
-        return self.plural_aspects.get(text, text)
+        return self.lexicon.label(token.lower_)
 
     def _is_direct_keyword(self, token):
-        return token.text.lower() in self.aspect_lexicon
+        return token.lower_ in self.aspect_lexicon
+
+    def _has_neighboring_mention(self, mentions, mention_rank):
+        # Avoid overly distant matching. The rank difference used to be
+        # taken the wrong way round and never limited anything, which
+        # mention_window=None keeps as the default.
+        if not mentions:
+            return False
+        window = self.parser.rules.mention_window
+        return window is None or mention_rank - mentions[-1][0] < window
+
+    def _parse_resolved_anaphora(self, token, clusters, mention_labels, aspect_opinions):
+        """
+        Attach the opinions on an anaphora word to the aspects mentioned in
+        its coreference cluster. False if no cluster links it to an aspect,
+        then the rank heuristic is used instead.
+        """
+        for cluster in clusters:
+            if not any(start <= token.i < end for start, end in cluster):
+                continue
+            matched_aspects = list(dict.fromkeys(
+                mention_labels[i] for start, end in cluster for i in range(start, end) if i in mention_labels))
+            if not matched_aspects:
+                return False
+            dprint(token.text, "resolved to", matched_aspects)
+            parses = self.parser.parse_zhuang_phrases(token)
+            if parses:
+                for matched_aspect in matched_aspects:
+                    aspect_opinions[matched_aspect] += parses
+            return True
+        return False
 
     def _parse_anaphora(self, token, mentions, mention_rank, aspect_opinions):
-        if token._.is_singular_item:
+        anaphora_kind = self.lexicon.anaphora_kind(token)
+        if anaphora_kind == 'singular':
             dprint(token.text)
             
-            has_neighboring_mentions = len(mentions) > 0 and mentions[-1][0] - mention_rank < 2
+            has_neighboring_mentions = self._has_neighboring_mention(mentions, mention_rank)
 
             if has_neighboring_mentions: # Avoid overly distant matching
                 matched_aspect = mentions[-1][1]
@@ -236,9 +851,9 @@ class Pipeline():
                 if parses:
                     dprint(matched_aspect)
                     aspect_opinions[matched_aspect] += parses
-        elif token._.is_plural_item:
+        elif anaphora_kind == 'plural':
             matched_mentions = []
-            has_neighboring_mentions = len(mentions) > 0 and mentions[-1][0] - mention_rank < 2
+            has_neighboring_mentions = self._has_neighboring_mention(mentions, mention_rank)
             if has_neighboring_mentions:
                 # Collection all mentions of equal rank in the backwards direction
                 # ensures we don't capture unnecessary mentions
@@ -254,9 +869,9 @@ class Pipeline():
                     matched_aspects = [mention[1] for mention in matched_mentions]
                     for matched_aspect in matched_aspects:
                         aspect_opinions[matched_aspect] += parses
-        elif token._.is_quantifier:
+        elif anaphora_kind == 'quantifier':
             matched_mentions = []
-            has_neighboring_mentions = len(mentions) > 0 and mentions[-1][0] - mention_rank < 2
+            has_neighboring_mentions = self._has_neighboring_mention(mentions, mention_rank)
             if has_neighboring_mentions:
                 # Collection all mentions of equal rank in the backwards direction
                 # ensures we don't capture unnecessary mentions
@@ -272,86 +887,226 @@ class Pipeline():
                     matched_aspects = [mention[1] for mention in matched_mentions]
                     for matched_aspect in matched_aspects:
                         aspect_opinions[matched_aspect] += parses
+        return anaphora_kind
+
+    def _match_docs(self, docs):
+        "'X was Y' matches of a batch of Docs, see AssociationMatcher"
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter()
+        matches = self.matcher.pipe(docs)
+        if stats is not None:
+            stats.time("stage", "matcher", time.perf_counter() - start)
+            stats.count("matches", "x_was_y", sum(len(doc_matches) for doc_matches in matches))
+        return matches
+
+    def _parse_review(self, doc, matches=None, clusters=None):
+        """
+        matches are the doc's _match_docs results when they were found
+        for a whole batch, otherwise the doc is matched on its own.
+        clusters are the doc's coreference clusters from a CorefStage,
+        if it was resolved.
+        """
+        stats = self.stats
+        if stats is not None:
+            stats.count("docs", "parsed")
+            stats.count("tokens", "visited", len(doc))
+        aspect_opinions = self._parse_tokens(doc, clusters)
+        self._merge_matches(doc, aspect_opinions, matches)
+
+        dprint("\n")
+        return aspect_opinions
 
-    def _parse_review(self, doc):
-        # dprint(doc._.coref_clusters)
+    def _parse_tokens(self, doc, clusters=None):
         aspect_opinions = defaultdict(list)
 
         mentions = []
+        stats = self.stats
+
+        # Only tokens flagged by the lexicon index can trigger a rule
+        if stats is not None:
+            start = time.perf_counter()
+        candidates, aspect_labels, anaphora_flags = self.lexicon.flag_tokens(doc)
+        if stats is not None:
+            stats.time("stage", "flag_tokens", time.perf_counter() - start)
+            stats.count("tokens", "candidates", len(candidates))
+        if not candidates:
+            return aspect_opinions
+        if clusters:
+            mention_labels = {i: aspect_label for i, aspect_label in zip(candidates, aspect_labels) if aspect_label is not None}
+
+        # Using rank to group mentions: a token's rank is the number of
+        # sentences started so far
+        rank_starts = [sent.start for sent in doc.sents if doc[sent.start].text not in ["("]]
+        for i, aspect_label, is_anaphora in zip(candidates, aspect_labels, anaphora_flags):
+            token = doc[i]
+            mention_rank = bisect_right(rank_starts, i)
+            if stats is not None:
+                start = time.perf_counter()
 
-        # Using rank to group mentions
-        mention_rank = 0
-        for token in doc:
-            if token.is_sent_start and token.text not in ["("]:
-                mention_rank += 1
-            
             dprint(token.text, token.pos_, token.dep_, token.head.text, token.head.pos_, [child.text for child in token.children])
             
-            if self._is_direct_keyword(token):
+            if aspect_label is not None:
+                branch = "keyword"
                 parses = self.parser.parse_zhuang_phrases(token)
 
-                aspect_label = self._process_matched_aspect_label(token)
                 mentions.append((mention_rank, aspect_label))
                 if parses:
                     aspect_opinions[aspect_label] += parses
-            elif token._.is_anaphora:
-                self._parse_anaphora(token, mentions, mention_rank, aspect_opinions)
+            elif is_anaphora and clusters and self._parse_resolved_anaphora(token, clusters, mention_labels, aspect_opinions):
+                branch = "anaphora_resolved"
+            elif is_anaphora:
+                anaphora_kind = self._parse_anaphora(token, mentions, mention_rank, aspect_opinions)
+                branch = f"anaphora_{anaphora_kind or 'none'}"
             elif token.pos_ == "NUM" and token.dep_ == "nsubj":
+                branch = "number"
+                self._parse_number(token, mentions, aspect_opinions)
+            else:
+                branch = "none"
 
-                if re.match("\d+", token.text) or len(mentions) < 1 or mentions[-1][0] > 2:
-                    # Ignore actual numbers
-                    continue
-                matched_mentions = []
-                # This is for now a special case not associated with the parser
-                # until i can find a better way to implement this
-                dprint("number case")
-                take_from = "tail"
-                for child in token.children:
-                    if child.text == "first":
-                        take_from == "head"
+            if stats is not None:
+                stats.time("branch", branch, time.perf_counter() - start)
+        return aspect_opinions
 
-                matched_mentions.append(mentions[-1])
+    def _parse_number(self, token, mentions, aspect_opinions):
+        "The NUM <-nsubj- case, e.g. 'the first two were ok'"
+        if re.match("\d+", token.text) or len(mentions) < 1 or mentions[-1][0] > 2:
+            # Ignore actual numbers
+            return
+        matched_mentions = []
+        # This is for now a special case not associated with the parser
+        # until i can find a better way to implement this
+        dprint("number case")
+        take_from = "tail"
+        for child in token.children:
+            if child.text == "first":
+                take_from == "head"
 
-                for i in range(len(mentions) - 2, -1, -1):
-                    if mentions[i][0] != matched_mentions[-1][0]:
-                        break
-                    matched_mentions.append(mentions[i])
-                numericalized_val = self._numericalize_value(token)
+        matched_mentions.append(mentions[-1])
 
-                if not numericalized_val:
-                    numericalized_val = 1
+        for i in range(len(mentions) - 2, -1, -1):
+            if mentions[i][0] != matched_mentions[-1][0]:
+                break
+            matched_mentions.append(mentions[i])
+        numericalized_val = self._numericalize_value(token)
 
-                if take_from == "tail":
-                    matched_mentions = matched_mentions[-min(numericalized_val, len(matched_mentions)):]
-                else:
-                    matched_mentions = matched_mentions[:min(numericalized_val, len(matched_mentions))]
-                parses = self.parser.parse_zhuang_phrases(token)
-                if parses:
-                    matched_aspects = [mention[1] for mention in matched_mentions]
-                    for matched_aspect in matched_aspects:
-                        aspect_opinions[matched_aspect] += parses
-        matches = self.matcher(doc)
-
-        for match_id, start, end in matches:
-            item, _, adj = doc[start:end].text.split(" ")
-            singular_item = plural_aspects.get(item, item) # De-pluralize items
-            item_opinions = aspect_opinions[singular_item]
-            for opinion in item_opinions:
-                if adj in opinion:
-                    break
-            else:
-                item_opinions.append(adj)
+        if not numericalized_val:
+            numericalized_val = 1
 
-        dprint("\n")
-        return aspect_opinions
+        if take_from == "tail":
+            matched_mentions = matched_mentions[-min(numericalized_val, len(matched_mentions)):]
+        else:
+            matched_mentions = matched_mentions[:min(numericalized_val, len(matched_mentions))]
+        parses = self.parser.parse_zhuang_phrases(token)
+        if parses:
+            matched_aspects = [mention[1] for mention in matched_mentions]
+            for matched_aspect in matched_aspects:
+                aspect_opinions[matched_aspect] += parses
+
+    def _merge_matches(self, doc, aspect_opinions, matches=None):
+        "Add the adjectives of 'X was Y' matches that the parse rules missed"
+        if matches is None:
+            matches = self._match_docs([doc])[0]
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter()
+
+        for match_id, item_index, end in matches:
+            aspect = self._process_matched_aspect_label(doc[item_index]) # De-pluralize items
+            adj = doc[end - 1].text
+            item_opinions = aspect_opinions[aspect]
+            # Substring test, so an adjective inside a longer opinion is not added again
+            if not any(adj in opinion for opinion in item_opinions):
+                item_opinions.append(Phrase(adj, end - 1, end, "x_was_y") if self.parser.track_spans else adj)
+        if stats is not None:
+            stats.time("stage", "merge", time.perf_counter() - start)
+
+    def _iter_batch(self, batch, prefilter, cache, **parse_kwargs):
+        "(index, aspect_opinions) of each review of a batch, with the batch parsed and matched at once"
+        if prefilter:
+            kept = [i for i, text in enumerate(batch) if self.prefilter(text)]
+        else:
+            kept = list(range(len(batch)))
+
+        start = time.perf_counter()
+        docs = preprocess_parallel([batch[i] for i in kept], model=self.model, cache=cache, **parse_kwargs) if kept else []
+        self.prefilter.record_parse(time.perf_counter() - start)
+
+        matches = self._match_docs(docs)
+        if self.coref is not None:
+            clusters = self.coref.resolve([batch[i] for i in kept], docs, self.lexicon, cache,
+                cache_namespace(self.model) if cache is not None else "")
+        else:
+            clusters = [None] * len(docs)
+        parsed_by_index = dict(zip(kept, zip(docs, matches, clusters)))
+        for i in range(len(batch)):
+            parsed = parsed_by_index.pop(i, None)
+            yield i, self._parse_review(*parsed) if parsed is not None else defaultdict(list)
+
+    def extract_batch(self, texts, cache=None, prefilter=True):
+        """
+        aspect_opinions of each review of a micro-batch, parsed in the
+        calling thread with the same prefilter, ParseCache and batched
+        matching as iter_descriptions, see async_pipeline.py
+        """
+        return [aspect_opinions for _, aspect_opinions in self._iter_batch(texts, prefilter, cache, n_jobs=1, batch_size=max(len(texts), 1))]
+
+    def iter_descriptions(self, raw_reviews, batch_size=10000, n_jobs=10, backend='threading', chunksize=1000, cache=None, prefilter=True, pipe_batch_size=20, length_batching=None):
+        """
+        Lazily yield (index, aspect_opinions) for any iterable of reviews.
+        Reviews are parsed `batch_size` at a time and each batch's Docs are
+        released before the next one is parsed, so memory stays bounded
+        regardless of the corpus size.
+        With prefilter, reviews without any lexicon term are not parsed
+        and get an empty result, see self.prefilter.stats().
+        """
+        pool = None
+        if backend == 'processes':
+            pool = ParsePool(model=self.model, n_jobs=n_jobs, batch_size=pipe_batch_size, length_batching=length_batching)
+        try:
+            offset = 0
+            for batch in batched(raw_reviews, batch_size):
+                for i, aspect_opinions in self._iter_batch(batch, prefilter, cache, chunksize=chunksize, n_jobs=n_jobs, backend=backend, pool=pool, batch_size=pipe_batch_size, length_batching=length_batching):
+                    yield offset + i, aspect_opinions
+                offset += len(batch)
+        finally:
+            if pool is not None:
+                pool.close()
 
-    def extract_descriptions(self, raw_reviews):
+    def extract_descriptions(self, raw_reviews, n_jobs=10, backend='threading', chunksize=1000, cache=None, prefilter=True, length_batching=None, compact=False):
+        """
+        With compact, the results are returned as a CompactResults instead
+        of a list of defaultdicts, see results.py
+        """
         print("Number of reviews:", len(raw_reviews))
-        reviews = []
+        reviews = CompactResults() if compact else []
+        # Print this call's numbers, not those of every call so far
+        self.prefilter.reset()
+        if self.coref is not None:
+            self.coref.reset()
 
         # docs = self.nlp.pipe(raw_reviews, disable=["ner"])
-        docs = preprocess_parallel(raw_reviews)
-        for doc in tqdm(docs):
-            reviews.append(self._parse_review(doc))
+        descriptions = self.iter_descriptions(
+            raw_reviews,
+            batch_size=max(len(raw_reviews), 1),
+            n_jobs=n_jobs,
+            backend=backend,
+            chunksize=chunksize,
+            cache=cache,
+            prefilter=prefilter,
+            length_batching=length_batching)
+        for _, aspect_opinions in tqdm(descriptions, total=len(raw_reviews)):
+            reviews.append(aspect_opinions)
+
+        if cache is not None:
+            print("Parse cache:", cache.stats())
+        if prefilter:
+            print("Prefilter:", self.prefilter.stats())
+        if self.coref is not None:
+            print("Coreference:", self.coref.stats())
         
-        return reviews
\ No newline at end of file
+        return reviews
+
+if __name__ == "__main__":
+    models = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    report_model_footprint(models or ('en_core_web_sm', 'en_core_web_md', 'en_core_web_lg'), shared_vectors="--shared-vectors" in sys.argv)
@@ -0,0 +1,115 @@
+import json
+from array import array
+from collections import defaultdict
+
+import numpy as np
+
+"""
+Compact storage for extraction results. Instead of one defaultdict of
+string lists per review, every (review, aspect, opinion) is a row of five
+integer columns and the aspect labels and phrases are stored once.
+"""
+
+COLUMNS = ("review_idx", "aspect_id", "phrase_id", "token_start", "token_end")
+
+class CompactResults():
+    """
+    Rows of review_idx, aspect_id, phrase_id, token_start, token_end.
+    aspects and phrases hold the interned strings the ids refer to, and
+    the token span is doc[token_start:token_end], or -1 for phrases
+    extracted without span tracking (see Pipeline(track_spans=True)).
+    Rows are appended in review order, so a review's opinions keep their
+    order through a round trip to the dict form.
+    """
+    def __init__(self, aspects=(), phrases=()):
+        super().__init__()
+        self.aspects = list(aspects)
+        self.phrases = list(phrases)
+        self._aspect_ids = {aspect: i for i, aspect in enumerate(self.aspects)}
+        self._phrase_ids = {phrase: i for i, phrase in enumerate(self.phrases)}
+        self.columns = {name: array('q') for name in COLUMNS}
+        self.num_reviews = 0
+
+    def __len__(self):
+        return self.num_reviews
+
+    def _intern(self, values, ids, value):
+        value_id = ids.get(value)
+        if value_id is None:
+            value_id = ids[value] = len(values)
+            values.append(value)
+        return value_id
+
+    def append(self, aspect_opinions):
+        "Add the next review's aspect_opinions and return its review_idx"
+        review_idx = self.num_reviews
+        for aspect, opinions in aspect_opinions.items():
+            aspect_id = self._intern(self.aspects, self._aspect_ids, aspect)
+            for opinion in opinions:
+                self.columns["review_idx"].append(review_idx)
+                self.columns["aspect_id"].append(aspect_id)
+                self.columns["phrase_id"].append(self._intern(self.phrases, self._phrase_ids, str(opinion)))
+                self.columns["token_start"].append(getattr(opinion, "start", -1))
+                self.columns["token_end"].append(getattr(opinion, "end", -1))
+        self.num_reviews += 1
+        return review_idx
+
+    def extend(self, descriptions):
+        for aspect_opinions in descriptions:
+            self.append(aspect_opinions)
+        return self
+
+    @classmethod
+    def from_descriptions(cls, descriptions):
+        return cls().extend(descriptions)
+
+    def arrays(self):
+        "The columns as int64 arrays, sharing memory with the results"
+        return {name: np.frombuffer(column, dtype=np.int64) if len(column) else np.zeros(0, dtype=np.int64)
+            for name, column in self.columns.items()}
+
+    def to_descriptions(self):
+        "The results as one defaultdict(list) per review, as returned by Pipeline.extract_descriptions"
+        descriptions = [defaultdict(list) for _ in range(self.num_reviews)]
+        columns = self.columns
+        for review_idx, aspect_id, phrase_id in zip(columns["review_idx"], columns["aspect_id"], columns["phrase_id"]):
+            descriptions[review_idx][self.aspects[aspect_id]].append(self.phrases[phrase_id])
+        return descriptions
+
+    def review(self, review_idx):
+        "aspect_opinions of a single review"
+        review_column = self.arrays()["review_idx"]
+        start, end = np.searchsorted(review_column, [review_idx, review_idx + 1])
+        aspect_opinions = defaultdict(list)
+        for row in range(start, end):
+            aspect = self.aspects[self.columns["aspect_id"][row]]
+            aspect_opinions[aspect].append(self.phrases[self.columns["phrase_id"][row]])
+        return aspect_opinions
+
+    def save_npz(self, path):
+        meta = json.dumps({"aspects": self.aspects, "phrases": self.phrases, "num_reviews": self.num_reviews})
+        np.savez_compressed(path, meta=np.array(meta), **self.arrays())
+
+    @classmethod
+    def load_npz(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            results = cls(meta["aspects"], meta["phrases"])
+            results.num_reviews = meta["num_reviews"]
+            for name in COLUMNS:
+                results.columns[name] = array('q', data[name].astype(np.int64).tobytes())
+        return results
+
+    def to_dataframe(self):
+        "One row per opinion, with aspect and phrase as categoricals over the interned strings"
+        import pandas as pd
+
+        arrays = self.arrays()
+        frame = pd.DataFrame({name: arrays[name] for name in ("review_idx", "token_start", "token_end")})
+        frame.insert(1, "aspect", pd.Categorical.from_codes(arrays["aspect_id"], categories=self.aspects))
+        frame.insert(2, "phrase", pd.Categorical.from_codes(arrays["phrase_id"], categories=self.phrases))
+        return frame
+
+    def to_parquet(self, path):
+        "Needs pyarrow or fastparquet"
+        self.to_dataframe().to_parquet(path)
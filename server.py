@@ -0,0 +1,243 @@
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from instrumentation import ExtractionStats
+from pipeline import DEFAULT_MODEL, Pipeline, pipe_texts
+
+"""
+Resident extraction service. The model is loaded once and concurrent
+requests are gathered into micro-batches for nlp.pipe.
+
+    python server.py --http 8000      POST /extract {"text": ...}, GET /metrics
+                                      (with --stats, GET /metrics/prometheus)
+    python server.py --stdin          one {"id": ..., "text": ...} JSON object per line
+"""
+
+class MicroBatcher():
+    """
+    Collects submitted reviews on a queue and parses them together: a
+    batch is sent to nlp.pipe once it holds max_batch reviews or its
+    first review has waited max_wait seconds.
+    """
+    def __init__(self, pipeline, max_batch=32, max_wait=0.01, latency_window=10000):
+        super().__init__()
+        self.pipeline = pipeline
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=latency_window)
+        self._batch_sizes = deque(maxlen=latency_window)
+        self.num_requests = 0
+        self.num_batches = 0
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, text):
+        "Future resolving to the review's aspect_opinions"
+        future = Future()
+        if not isinstance(text, str):
+            future.set_exception(TypeError(f"text must be a string, not {type(text).__name__}"))
+            return future
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def extract(self, text, timeout=None):
+        return self.submit(text).result(timeout)
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        try:
+            nlp = self.pipeline.nlp
+        except Exception as error:
+            # Fail every request instead of leaving them waiting forever
+            while True:
+                for _, future, _ in self._next_batch():
+                    future.set_exception(error)
+
+        while True:
+            batch = self._next_batch()
+            # A review the prefilter can't handle fails on its own, not with its batch
+            parsed = []
+            for item in batch:
+                try:
+                    keep = self.pipeline.prefilter(item[0])
+                except Exception as error:
+                    item[1].set_exception(error)
+                    continue
+                if keep:
+                    parsed.append(item)
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                continue
+            try:
+                docs = list(pipe_texts(nlp, [text for text, _, _ in parsed], batch_size=len(parsed)))
+                matches = self.pipeline._match_docs(docs)
+                results = {id(item): self.pipeline._parse_review(doc, doc_matches) for item, doc, doc_matches in zip(parsed, docs, matches)}
+            except Exception as error:
+                for _, future, _ in batch:
+                    future.set_exception(error)
+                continue
+
+            finished = time.perf_counter()
+            with self._lock:
+                self.num_requests += len(batch)
+                self.num_batches += 1
+                self._batch_sizes.append(len(batch))
+                self._latencies.extend(finished - submitted for _, _, submitted in batch)
+            for item in batch:
+                item[1].set_result(dict(results.get(id(item), {})))
+
+    def metrics(self):
+        with self._lock:
+            latencies = list(self._latencies)
+            batch_sizes = list(self._batch_sizes)
+            metrics = {
+                "queue_depth": self._queue.qsize(),
+                "requests": self.num_requests,
+                "batches": self.num_batches,
+            }
+        metrics["mean_batch_size"] = float(np.mean(batch_sizes)) if batch_sizes else 0.
+        metrics["max_batch_size"] = max(batch_sizes, default=0)
+        for percentile in (50, 99):
+            metrics[f"latency_p{percentile}_seconds"] = float(np.percentile(latencies, percentile)) if latencies else 0.
+        if self.pipeline.stats is not None:
+            metrics["extraction"] = self.pipeline.stats.to_dict()
+        return metrics
+
+def _make_handler(batcher):
+    class ExtractionHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                self._send_json(200, batcher.metrics())
+            elif self.path == "/metrics/prometheus" and batcher.pipeline.stats is not None:
+                body = batcher.pipeline.stats.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/extract":
+                self._send_json(404, {"error": "not found"})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                text = request["text"]
+            except (ValueError, KeyError, TypeError):
+                self._send_json(400, {"error": 'expected a JSON body {"text": ...}'})
+                return
+            if not isinstance(text, str):
+                self._send_json(400, {"error": '"text" must be a string'})
+                return
+            try:
+                aspect_opinions = batcher.extract(text)
+            except Exception as error:
+                self._send_json(500, {"error": f"{type(error).__name__}: {error}"})
+                return
+            self._send_json(200, {"aspect_opinions": aspect_opinions})
+
+        def log_message(self, format, *args):
+            pass
+
+    return ExtractionHandler
+
+def serve_http(batcher, port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), _make_handler(batcher))
+    print(f"Serving on http://{host}:{port}", file=sys.stderr)
+    server.serve_forever()
+
+def serve_stdin(batcher, input_stream=sys.stdin, output_stream=sys.stdout):
+    """
+    Read JSON lines and write one result line per request, in input order.
+    Requests are submitted as soon as they are read, so lines arriving
+    together end up in the same batch. A request that fails gets an
+    {"id": ..., "error": ...} line instead.
+    """
+    pending = queue.Queue()
+
+    def write_results():
+        while True:
+            request = pending.get()
+            if request is None:
+                return
+            request_id, future = request
+            try:
+                result = {"id": request_id, "aspect_opinions": future.result()}
+            except Exception as error:
+                result = {"id": request_id, "error": f"{type(error).__name__}: {error}"}
+            output_stream.write(json.dumps(result) + "\n")
+            output_stream.flush()
+
+    writer = threading.Thread(target=write_results)
+    writer.start()
+    for line in input_stream:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+            request_id, text = request.get("id"), request["text"]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            future = Future()
+            future.set_exception(ValueError('expected a JSON object {"id": ..., "text": ...}'))
+            pending.put((None, future))
+            continue
+        pending.put((request_id, batcher.submit(text)))
+    pending.put(None)
+    writer.join()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--http", type=int, metavar="PORT")
+    mode.add_argument("--stdin", action="store_true")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-wait", type=float, default=0.01)
+    parser.add_argument("--stats", action="store_true", help="Count and time the extraction rules")
+    args = parser.parse_args()
+
+    pipeline = Pipeline(model=args.model, stats=ExtractionStats() if args.stats else None)
+    # Load the model before accepting requests
+    pipeline.nlp
+    batcher = MicroBatcher(pipeline, max_batch=args.max_batch, max_wait=args.max_wait)
+
+    if args.stdin:
+        serve_stdin(batcher)
+    else:
+        serve_http(batcher, args.http, args.host)
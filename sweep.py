@@ -0,0 +1,98 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+from dataset import PROCESSED_DATA_PATH
+from evaluation import LEXICON, load_annotated_corpus
+from metrics import evaluate
+from parse_cache import ParseCache
+from parse_store import ParseStore, build_parse_store
+from pipeline import DEFAULT_MODEL, DEFAULT_RULES, Pipeline, RuleConfig, blank_vocab
+
+"""
+Sweep over rule settings on the annotated corpus. The corpus is parsed
+once into a ParseStore, and each RuleConfig is then evaluated from the
+stored parses in a process pool.
+
+    python sweep.py [--model NAME] [--n-jobs 4] [--output sweep.json]
+"""
+
+ANNOTATED_STORE_PATH = os.path.join(PROCESSED_DATA_PATH, "annotated_parses")
+
+def default_variants():
+    "Each modifier dep left out in turn, each complement dep alone, and several anaphora windows"
+    modifier_options = [DEFAULT_RULES.modifier_deps] + [
+        DEFAULT_RULES.modifier_deps - {dep} for dep in sorted(DEFAULT_RULES.modifier_deps)]
+    complement_options = [DEFAULT_RULES.complement_deps] + [{dep} for dep in sorted(DEFAULT_RULES.complement_deps)]
+    window_options = [None, 1, 2, 3]
+    return [RuleConfig(modifier_deps=modifier_deps, complement_deps=complement_deps, mention_window=window)
+        for modifier_deps, complement_deps, window in itertools.product(modifier_options, complement_options, window_options)]
+
+_sweep_docs = None
+_sweep_matches = None
+_sweep_references = None
+
+def _init_sweep_worker(path, references):
+    global _sweep_docs, _sweep_matches, _sweep_references
+    # Docs and their 'X was Y' matches don't depend on the rule settings,
+    # so they are made once per worker and shared by every variant it runs
+    _sweep_docs = [doc for _, doc in ParseStore(path).iter_docs(blank_vocab())]
+    _sweep_matches = Pipeline(model=None)._match_docs(_sweep_docs)
+    _sweep_references = references
+
+def _evaluate_variant(rules):
+    pipeline = Pipeline(model=None, track_spans=True, rules=rules)
+    start = time.perf_counter()
+    hypotheses = [pipeline._parse_review(doc, matches) for doc, matches in zip(_sweep_docs, _sweep_matches)]
+    extract_seconds = time.perf_counter() - start
+    results = evaluate(hypotheses, _sweep_references, LEXICON, num_samples=200)
+    overall = results["overall"]
+    row = {"rules": rules.to_dict(), "extract_seconds": extract_seconds, "evaluate_seconds": time.perf_counter() - start - extract_seconds}
+    for match in ("exact", "inexact"):
+        precision = overall[f"{match}_precision"]["value"]
+        recall = overall[f"{match}_recall"]["value"]
+        row[f"{match}_precision"] = precision
+        row[f"{match}_recall"] = recall
+        row[f"{match}_f1"] = 2 * precision * recall / (precision + recall) if precision + recall else 0.
+        row[f"{match}_precision_ci"] = overall[f"{match}_precision"]["ci"]
+        row[f"{match}_recall_ci"] = overall[f"{match}_recall"]["ci"]
+    return row
+
+def run_sweep(variants, path=ANNOTATED_STORE_PATH, model=DEFAULT_MODEL, n_jobs=4, rank_by="exact_f1", rebuild=False):
+    "Evaluate every RuleConfig in variants and return the rows sorted by rank_by, best first"
+    texts, references = load_annotated_corpus()
+    if rebuild or not os.path.exists(os.path.join(path, "meta.json")):
+        build_parse_store(texts, path, model=model, cache=ParseCache())
+    assert len(ParseStore(path)) == len(texts), f"{path} holds a different corpus, rebuild it"
+
+    with multiprocessing.Pool(n_jobs, initializer=_init_sweep_worker, initargs=(path, references)) as pool:
+        rows = pool.map(_evaluate_variant, variants)
+    return sorted(rows, key=lambda row: -row[rank_by])
+
+def print_table(rows):
+    print(f"{'rank':>4} {'exact P':>8} {'exact R':>8} {'exact F1':>8} {'inex P':>8} {'inex R':>8} {'seconds':>8}  rules")
+    for rank, row in enumerate(rows, 1):
+        rules = row["rules"]
+        description = f"modifiers={','.join(rules['modifier_deps'])} complements={','.join(rules['complement_deps'])} window={rules['mention_window']}"
+        print(f"{rank:>4} {row['exact_precision']:8.3f} {row['exact_recall']:8.3f} {row['exact_f1']:8.3f} "
+            f"{row['inexact_precision']:8.3f} {row['inexact_recall']:8.3f} {row['extract_seconds'] + row['evaluate_seconds']:8.2f}  {description}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--store", default=ANNOTATED_STORE_PATH)
+    parser.add_argument("--n-jobs", type=int, default=4)
+    parser.add_argument("--rank-by", default="exact_f1", choices=[
+        f"{match}_{score}" for match in ("exact", "inexact") for score in ("precision", "recall", "f1")])
+    parser.add_argument("--rebuild", action="store_true")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    rows = run_sweep(default_variants(), args.store, args.model, args.n_jobs, args.rank_by, args.rebuild)
+    print_table(rows)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(rows, output_file, indent=2)
@@ -0,0 +1,95 @@
+"""
+Regression tests for AspectLexicon.flag_tokens against the per-token
+loop it replaced in Pipeline._parse_tokens, on fixed parses.
+
+    python -m pytest test_lexicon.py
+"""
+
+from pipeline import Pipeline, blank_vocab, parse_to_doc
+from lexicon import DEFAULT_LEXICON
+
+def parse(spec):
+    "Compact parse from (word, pos, lemma, dep, head) rows, every word followed by a space"
+    return (
+        [row[0] for row in spec],
+        [True] * len(spec),
+        [row[1] for row in spec],
+        [row[2] for row in spec],
+        [row[3] for row in spec],
+        [row[4] for row in spec],
+    )
+
+PARSES = [
+    # The Pizza was incredible . It was delicious .
+    parse([("The", "DET", "the", "det", 1), ("Pizza", "NOUN", "pizza", "nsubj", 2), ("was", "AUX", "be", "ROOT", 2),
+        ("incredible", "ADJ", "incredible", "acomp", 2), (".", "PUNCT", ".", "punct", 2),
+        ("It", "PRON", "it", "nsubj", 6), ("was", "AUX", "be", "ROOT", 6), ("delicious", "ADJ", "delicious", "acomp", 6),
+        (".", "PUNCT", ".", "punct", 6)]),
+    # Cold bruschetta and undercooked lasagna .
+    parse([("Cold", "ADJ", "cold", "amod", 1), ("bruschetta", "NOUN", "bruschetta", "ROOT", 1), ("and", "CCONJ", "and", "cc", 1),
+        ("undercooked", "VERB", "undercook", "amod", 4), ("lasagna", "NOUN", "lasagna", "conj", 1), (".", "PUNCT", ".", "punct", 1)]),
+    # I had pizzas and gelatos . They were not very good .
+    parse([("I", "PRON", "I", "nsubj", 1), ("had", "VERB", "have", "ROOT", 1), ("pizzas", "NOUN", "pizza", "dobj", 1),
+        ("and", "CCONJ", "and", "cc", 2), ("gelatos", "NOUN", "gelato", "conj", 2), (".", "PUNCT", ".", "punct", 1),
+        ("They", "PRON", "they", "nsubj", 7), ("were", "AUX", "be", "ROOT", 7), ("not", "PART", "not", "neg", 7),
+        ("very", "ADV", "very", "advmod", 10), ("good", "ADJ", "good", "acomp", 7), (".", "PUNCT", ".", "punct", 7)]),
+    # I had the pizza and the lasagne . The first two were ok .
+    parse([("I", "PRON", "I", "nsubj", 1), ("had", "VERB", "have", "ROOT", 1), ("the", "DET", "the", "det", 3),
+        ("pizza", "NOUN", "pizza", "dobj", 1), ("and", "CCONJ", "and", "cc", 3), ("the", "DET", "the", "det", 6),
+        ("lasagne", "NOUN", "lasagna", "conj", 3), (".", "PUNCT", ".", "punct", 1),
+        ("The", "DET", "the", "det", 10), ("first", "ADJ", "first", "amod", 10), ("two", "NUM", "two", "nsubj", 11),
+        ("were", "AUX", "be", "ROOT", 11), ("ok", "ADJ", "ok", "acomp", 11), (".", "PUNCT", ".", "punct", 11)]),
+    # Gnocchi and gelato , everything was great . 2 were cold .
+    parse([("Gnocchi", "NOUN", "gnocchi", "nsubj", 5), ("and", "CCONJ", "and", "cc", 0), ("gelato", "NOUN", "gelato", "conj", 0),
+        (",", "PUNCT", ",", "punct", 5), ("everything", "PRON", "everything", "nsubj", 5), ("was", "AUX", "be", "ROOT", 5),
+        ("great", "ADJ", "great", "acomp", 5), (".", "PUNCT", ".", "punct", 5),
+        ("2", "NUM", "2", "nsubj", 9), ("were", "AUX", "be", "ROOT", 9), ("cold", "ADJ", "cold", "acomp", 9), (".", "PUNCT", ".", "punct", 9)]),
+    # Nothing .
+    parse([("Nothing", "PRON", "nothing", "ROOT", 0), (".", "PUNCT", ".", "punct", 0)]),
+]
+
+# Outputs of the per-token loop, except that 'Pizza was incredible' from the
+# 'X was Y' matcher is now merged into 'pizza' instead of its own 'Pizza' label
+EXPECTED = [
+    {'pizza': ['incredible', 'delicious']},
+    {'bruschetta': ['Cold'], 'lasagna': ['undercooked']},
+    {'gelato': ['not very good'], 'pizza': ['not very good']},
+    {'pizza': ['ok']},
+    {'gnocchi': ['great', 'great'], 'gelato': ['great', 'great']},
+    {},
+]
+
+def loop_flags(doc, aspect_lexicon=DEFAULT_LEXICON.terms, plural_aspects=DEFAULT_LEXICON.plurals):
+    "The tests the per-token loop made, in its order of precedence"
+    candidates, labels, is_anaphora = [], [], []
+    for token in doc:
+        text = token.text.lower()
+        if text in aspect_lexicon:
+            candidates.append(token.i)
+            labels.append(plural_aspects.get(text, text))
+            is_anaphora.append(False)
+        elif text in ("it", "they", "every", "everything"):
+            candidates.append(token.i)
+            labels.append(None)
+            is_anaphora.append(True)
+        elif token.pos_ == "NUM" and token.dep_ == "nsubj":
+            candidates.append(token.i)
+            labels.append(None)
+            is_anaphora.append(False)
+    return candidates, labels, is_anaphora
+
+def test_flag_tokens_matches_token_loop():
+    vocab = blank_vocab()
+    for compact_parse in PARSES:
+        doc = parse_to_doc(vocab, compact_parse)
+        assert DEFAULT_LEXICON.flag_tokens(doc) == loop_flags(doc)
+
+def test_flag_tokens_fixed_flags():
+    doc = parse_to_doc(blank_vocab(), PARSES[4])
+    assert DEFAULT_LEXICON.flag_tokens(doc) == ([0, 2, 4, 8], ['gnocchi', 'gelato', None, None], [False, False, True, False])
+
+def test_extraction_on_fixed_parses():
+    pipeline = Pipeline(model=None)
+    vocab = blank_vocab()
+    for compact_parse, expected in zip(PARSES, EXPECTED):
+        assert dict(pipeline._parse_review(parse_to_doc(vocab, compact_parse))) == expected
@@ -0,0 +1,100 @@
+"""
+Regression tests for the batched 'X was Y' matcher and the merge of its
+matches by token index, against the spaCy Matcher pattern and the
+text-splitting merge they replaced, on fixed parses.
+
+    python -m pytest test_matcher.py
+"""
+
+from collections import defaultdict
+
+from lexicon import DEFAULT_LEXICON
+from pipeline import AssociationMatcher, Pipeline, blank_vocab, parse_to_doc
+
+def parse(spec):
+    "Compact parse from (word, pos, lemma, dep, head) rows, every word followed by a space"
+    return (
+        [row[0] for row in spec],
+        [True] * len(spec),
+        [row[1] for row in spec],
+        [row[2] for row in spec],
+        [row[3] for row in spec],
+        [row[4] for row in spec],
+    )
+
+PARSES = [
+    # The Pizza was great .
+    parse([("The", "DET", "the", "det", 1), ("Pizza", "NOUN", "pizza", "nsubj", 2), ("was", "AUX", "be", "ROOT", 2),
+        ("great", "ADJ", "great", "acomp", 2), (".", "PUNCT", ".", "punct", 2)]),
+    # Lasagne is cold and gnocchi were hot .
+    parse([("Lasagne", "NOUN", "lasagna", "nsubj", 1), ("is", "AUX", "be", "ROOT", 1), ("cold", "ADJ", "cold", "acomp", 1),
+        ("and", "CCONJ", "and", "cc", 1), ("gnocchi", "NOUN", "gnocchi", "nsubj", 5), ("were", "AUX", "be", "conj", 1),
+        ("hot", "ADJ", "hot", "acomp", 5), (".", "PUNCT", ".", "punct", 1)]),
+    # I think the pizza was   (followed by a Doc starting with an adjective)
+    parse([("I", "PRON", "I", "nsubj", 1), ("think", "VERB", "think", "ROOT", 1), ("the", "DET", "the", "det", 3),
+        ("pizza", "NOUN", "pizza", "nsubj", 4), ("was", "AUX", "be", "ccomp", 1)]),
+    # good gelatos be
+    parse([("good", "ADJ", "good", "ROOT", 0), ("gelatos", "NOUN", "gelato", "nsubj", 2), ("be", "AUX", "be", "ROOT", 2)]),
+    parse([]),
+    # pizzas were very good . Bruschetta was hot
+    parse([("pizzas", "NOUN", "pizza", "nsubj", 1), ("were", "AUX", "be", "ROOT", 1), ("very", "ADV", "very", "advmod", 3),
+        ("good", "ADJ", "good", "acomp", 1), (".", "PUNCT", ".", "punct", 1),
+        ("Bruschetta", "NOUN", "bruschetta", "nsubj", 6), ("was", "AUX", "be", "ROOT", 6), ("hot", "ADJ", "hot", "acomp", 6)]),
+]
+
+# (start, end) of the matches of the spaCy Matcher with the pattern
+#     [{"LOWER": {"IN": terms}}, {"LEMMA": "be"}, {"POS": "ADJ"}]
+EXPECTED_MATCHES = [[(1, 4)], [(0, 3), (4, 7)], [], [], [], [(5, 8)]]
+
+EXPECTED_OPINIONS = [
+    {'pizza': ['great']},
+    {'gnocchi': ['hot'], 'lasagna': ['cold']},
+    {},
+    {},
+    {},
+    {'pizza': ['very good'], 'bruschetta': ['hot']},
+]
+
+def docs():
+    vocab = blank_vocab()
+    return [parse_to_doc(vocab, compact_parse) for compact_parse in PARSES]
+
+def split_text_merge(doc, aspect_opinions, matches, plural_aspects=DEFAULT_LEXICON.plurals):
+    "The merge that split each match's text, with labels lowercased as the index-based merge does"
+    for match_id, start, end in matches:
+        item, _, adj = doc[start:end].text.split(" ")
+        item = item.lower()
+        item_opinions = aspect_opinions[plural_aspects.get(item, item)]
+        for opinion in item_opinions:
+            if adj in opinion:
+                break
+        else:
+            item_opinions.append(adj)
+
+def test_batched_matches_match_pattern():
+    matcher = AssociationMatcher(DEFAULT_LEXICON.match_terms)
+    matches = matcher.pipe(docs())
+    assert [[(start, end) for _, start, end in doc_matches] for doc_matches in matches] == EXPECTED_MATCHES
+
+def test_batched_matches_equal_per_doc_matches():
+    matcher = AssociationMatcher(DEFAULT_LEXICON.match_terms)
+    batch = docs()
+    assert matcher.pipe(batch) == [matcher(doc) for doc in batch]
+
+def test_merge_by_token_index_equals_split_text_merge():
+    pipeline = Pipeline(model=None)
+    batch = docs()
+    for doc, doc_matches, expected in zip(batch, pipeline._match_docs(batch), EXPECTED_OPINIONS):
+        merged = pipeline._parse_tokens(doc)
+        pipeline._merge_matches(doc, merged, doc_matches)
+        reference = pipeline._parse_tokens(doc)
+        split_text_merge(doc, reference, doc_matches)
+        assert merged == reference
+        assert dict(merged) == expected
+
+def test_merge_skips_adjective_inside_existing_opinion():
+    pipeline = Pipeline(model=None)
+    doc = docs()[1]
+    aspect_opinions = defaultdict(list, {'gnocchi': ['red-hot'], 'lasagna': ['cold']})
+    pipeline._merge_matches(doc, aspect_opinions)
+    assert dict(aspect_opinions) == {'gnocchi': ['red-hot'], 'lasagna': ['cold']}
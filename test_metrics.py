@@ -0,0 +1,82 @@
+"""
+Regression tests for metrics.evaluate against the counting loop of the
+original evaluation.compute_metrics, on fixed hypotheses and references.
+
+    python -m pytest test_metrics.py
+"""
+
+from collections import defaultdict
+
+import pytest
+
+from metrics import evaluate
+
+ASPECTS = ['pizza', 'gnocchi', 'bruschetta', 'gelato', 'lasagna']
+
+def opinions(**aspect_opinions):
+    d = defaultdict(list)
+    d.update(aspect_opinions)
+    return d
+
+HYPOTHESES = [
+    opinions(pizza=['incredible', 'delicious']),
+    opinions(bruschetta=['Cold'], lasagna=['undercooked', 'undercooked']),
+    opinions(gelato=['good'], pizza=['not very good']),
+    opinions(),
+    opinions(gnocchi=['great'], gelato=['great', 'cold']),
+    opinions(pizza=['ok'], lasagna=['ok']),
+]
+
+REFERENCES = [
+    opinions(pizza=['incredible', 'delicious']),
+    opinions(bruschetta=['Cold'], lasagna=['undercooked']),
+    opinions(gelato=['not very good'], pizza=['not very good']),
+    opinions(pizza=['hot']),
+    opinions(gnocchi=['great']),
+    opinions(),
+]
+
+def loop_scores(hypotheses, references, aspects):
+    "Exact and inexact precision and recall as the original compute_metrics counted them"
+    exact = inexact = hypothesis_items = reference_items = 0
+    for h, r in zip(hypotheses, references):
+        for item in aspects:
+            hypothesis_opinions = set(h[item])
+            reference_opinions = set(r[item])
+            hypothesis_items += len(hypothesis_opinions)
+            reference_items += len(reference_opinions)
+            for h_opinion in hypothesis_opinions:
+                for r_opinion in reference_opinions:
+                    exact += h_opinion == r_opinion
+                    inexact += h_opinion in r_opinion
+
+    def accuracy(partial, total):
+        return partial / total if total > 0 else 0
+    return {
+        "exact_precision": accuracy(exact, hypothesis_items),
+        "exact_recall": accuracy(exact, reference_items),
+        "inexact_precision": accuracy(inexact, hypothesis_items),
+        "inexact_recall": accuracy(inexact, reference_items),
+    }
+
+def test_overall_matches_counting_loop():
+    overall = evaluate(HYPOTHESES, REFERENCES, ASPECTS, num_samples=10)["overall"]
+    for name, value in loop_scores(HYPOTHESES, REFERENCES, ASPECTS).items():
+        assert overall[name]["value"] == pytest.approx(value)
+
+def test_overall_fixed_scores():
+    overall = evaluate(HYPOTHESES, REFERENCES, ASPECTS, num_samples=10)["overall"]
+    assert overall["exact_precision"]["value"] == pytest.approx(6 / 11)
+    assert overall["exact_recall"]["value"] == pytest.approx(6 / 8)
+    assert overall["inexact_precision"]["value"] == pytest.approx(7 / 11)
+    assert overall["inexact_recall"]["value"] == pytest.approx(7 / 8)
+
+def test_empty_input_scores_zero():
+    overall = evaluate([], [], ASPECTS, num_samples=10)["overall"]
+    assert all(overall[name]["value"] == 0 for name in loop_scores([], [], ASPECTS))
+
+def test_per_aspect_matches_counting_loop():
+    per_aspect = evaluate(HYPOTHESES, REFERENCES, ASPECTS, num_samples=10)["per_aspect"]
+    for aspect in ASPECTS:
+        for name, value in loop_scores(HYPOTHESES, REFERENCES, [aspect]).items():
+            assert per_aspect[aspect][name]["value"] == pytest.approx(value)
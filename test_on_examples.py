@@ -1,4 +1,5 @@
 from pipeline import Pipeline
+from parse_cache import ParseCache
 from pprint import pprint
 from scipy.stats import describe
 
@@ -37,7 +38,7 @@ if __name__ == "__main__":
     # pprint(list([(i + 1, e) for (i, e) in enumerate(
     #     pipeline.extract_descriptions(get_provided_examples()))]))
     provided_examples = cherry_picked_examples()
-    res = zip(provided_examples, pipeline.extract_descriptions(provided_examples))
+    res = zip(provided_examples, pipeline.extract_descriptions(provided_examples, cache=ParseCache()))
 
     for i, r in enumerate(res):
         # print(f"{i + 1} {r[0]} {r[1]}")